@@ -1,3 +1,4 @@
-from .ollama_client import OllamaClient
-from .openai_client import OpenAI_Client
-from .client import LLM_Client
\ No newline at end of file
+from .ollama_client import OllamaClient, AsyncOllamaClient
+from .openai_client import OpenAI_Client, AsyncOpenAI_Client
+from .client import LLM_Client, AsyncLLM_Client
+from .history import HistoryManager
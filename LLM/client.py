@@ -1,14 +1,62 @@
 import os
-from retrieval.solr_handler import SolrHandler
-from langdetect import detect
-from typing import Any, Generator
+import time
+import asyncio
+from retrieval.retriever import Retriever
+from retrieval.language_detector import LanguageDetector, Detection
+from retrieval.metrics import Metrics
+from .history import HistoryManager
+from typing import Any, Generator, Tuple, AsyncIterator
+
+metrics = Metrics.shared()
+
+class GenerationTimer:
+    """
+    measures the time to the first token and the tokens/s of a streamed answer (nothing is measured while the metrics are off)
+    the tokens/s come from the token count and duration of the model if it reports them, otherwise from the time after the first token
+    """
+    def __init__(self, model : str):
+        super().__init__()
+        self.model = model
+        self.enabled = metrics.enabled
+        self.start = time.perf_counter() if self.enabled else 0.0
+        self.first_token : float = None
+        self.chunks = 0
+
+    def token(self):
+        if not self.enabled:
+            return
+
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+            metrics.observe("llm_time_to_first_token_seconds", self.first_token - self.start, model=self.model)
+
+        self.chunks += 1
+
+    def finish(self, tokens : int = None, seconds : float = None):
+        if not self.enabled or self.first_token is None:
+            return
+
+        end = time.perf_counter()
+
+        # without the duration of the model only the tokens after the first one are timed
+        if not seconds:
+            tokens, seconds = (tokens or self.chunks) - 1, end - self.first_token
+
+        if tokens > 0 and seconds > 0:
+            metrics.observe("llm_tokens_per_second", tokens / seconds, model=self.model)
+
+        metrics.observe("llm_request_seconds", end - self.start, model=self.model)
 
 class LLM_Client:
-    def __init__(self, solr : SolrHandler, insertion_format = None, use_explicit_query = False):
+    def __init__(self, solr : Retriever, insertion_format = None, use_explicit_query = False, detector : LanguageDetector = None, history : HistoryManager = None, context_last : bool = True):
         super().__init__()
         self.solr = solr
+        self.detector = detector if detector else LanguageDetector.shared()
+        self.last_detection : Detection = None
 
         self.message_history : list[dict[str, str]] = []
+        # the part of the history sent to the model
+        self.history = history if history else HistoryManager()
 
         self.contexts_dir : str = "" 
         self.assistants : list[str] = []
@@ -22,6 +70,8 @@ class LLM_Client:
             self.insertion_format = "Answer the question based only on the context below: \nContext: {data} \nQuestion: {query}"
         
         self.use_explicit_query = use_explicit_query
+        # the retrieved context is only added to the last message, so the beginning of the prompt stays the same (and cached by the model)
+        self.context_last = context_last
 
     # loads all the assistant names from the contexts directory
     def load_assistant_names(self):
@@ -43,6 +93,11 @@ class LLM_Client:
         self.message_history = [
             {"role": "system", "content": self._get_context_prompt(assistant) }    
         ]
+        self.history.reset()
+
+    # the messages of the current turn within the token budget
+    def prompt_messages(self) -> list[dict[str, str]]:
+        return self.history.fit(self.message_history)
 
     def insert_docs_to_query(self, data : str, query : str, sources : list[str] = []):
         self.message_history.append({
@@ -58,30 +113,92 @@ class LLM_Client:
         else:
             return message.startswith("/query")
 
-    def run_query(self):
-        last_question = self.message_history.pop()['content']
-        language = detect(last_question)
-
-        if language not in ['en', 'de', 'hu']:
-            language = 'en'
+    # detects the language of the question and searches its documents, the history isn't changed
+    def retrieve(self, question : str) -> Tuple[list[str], list[str]]:
+        # only the indexed languages (en, de, hu) can be detected
+        with metrics.span("query_step", step="detect_language"):
+            self.last_detection = self.detector.detect(question)
 
         # trying to remove unnecessarry characters
-        query_text = last_question.strip().removesuffix('?')
+        query_text = question.strip().removesuffix('?')
 
-        found = self.solr.search(query_text, language, 10)
+        with metrics.span("query_step", step="search"):
+            return self.solr.search(query_text, self.last_detection.language, 10, self.last_detection.confidence)
 
-        results = found[0]
-        sources = found[1]
+    def insert_results(self, question : str, results : list[str], sources : list[str]):
+        #! sometimes "No data found" may not fit the prompt format
+        data = "\n".join(results) if len(results) > 0 else "No data found"
 
-        if len(results) == 0:
-            #! sometimes this may not fit the prompt format
-            self.insert_docs_to_query("No data found", last_question, [])
-        else:
-            self.insert_docs_to_query("\n".join(results), last_question, sources)
+        if self.context_last:
+            # the question stays in the history as it was asked, the context is only part of its own turn
+            self.message_history.append({
+                "role": "user",
+                "content": question,
+                "context": self.insertion_format.format(data=data, query=question),
+                "sources": sources
+            })
+            return
+
+        self.insert_docs_to_query(data, question, sources if len(results) > 0 else [])
 
         # Add the user question back so Ollama receives proper user message
-        self.message_history.append({"role": "user", "content": last_question})
+        self.message_history.append({"role": "user", "content": question})
+
+    # the sources of the documents used for the last answer
+    def last_sources(self) -> list[str]:
+        for message in reversed(self.message_history[-3:]):
+            if "sources" in message:
+                return message["sources"]
+
+        return []
+
+    def run_query(self):
+        with metrics.span("run_query"):
+            last_question = self.message_history.pop()['content']
+            results, sources = self.retrieve(last_question)
+
+            with metrics.span("query_step", step="prompt"):
+                self.insert_results(last_question, results, sources)
 
     def new_message(self, message : str) -> Generator[Any, Any, None]:
         # override this method in the child class
-        pass
\ No newline at end of file
+        pass
+
+class AsyncLLM_Client(LLM_Client):
+    """
+    asyncio variant of the client, one event loop can serve many conversations
+    the blocking retrieval (language detection + search) runs in a thread while the model is warmed up
+    an abandoned (cancelled or closed) request leaves the history as it was before the message
+    """
+    async def warm_up(self):
+        # override this method in the child class
+        pass
+
+    def _stream(self, messages : list[dict[str, str]]) -> AsyncIterator[str]:
+        # override this method in the child class
+        pass
+
+    async def new_message(self, message : str) -> AsyncIterator[str]:
+        should_run_query = self.should_run_query(message)
+
+        if self.use_explicit_query:
+            message = message.removeprefix("/query")
+
+        history_length = len(self.message_history)
+        response = []
+
+        try:
+            if should_run_query:
+                results, sources = (await asyncio.gather(asyncio.to_thread(self.retrieve, message), self.warm_up()))[0]
+                self.insert_results(message, results, sources)
+            else:
+                self.message_history.append({"role": "user", "content": message})
+
+            async for content in self._stream(self.prompt_messages()):
+                response.append(content)
+                yield content
+        except (asyncio.CancelledError, GeneratorExit):
+            del self.message_history[history_length:]
+            raise
+
+        self.message_history.append({"role": "assistant", "content": "".join(response)})
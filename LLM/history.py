@@ -0,0 +1,92 @@
+from typing import Optional
+from retrieval.metrics import Metrics
+
+metrics = Metrics.shared()
+
+class HistoryManager:
+    """
+    keeps the prompt of a conversation under a token budget
+    the assistant system prompt always stays, the older retrieved contexts (system messages with "sources") are dropped first,
+    then the oldest turns, the history itself isn't changed
+    when the budget is exceeded, the prompt is cut to trim_ratio of the budget and the following turns start at the same message,
+    so the beginning of the prompt stays the same for several turns (and the model can reuse its cache)
+    """
+    def __init__(self, max_tokens : int = 3000, chars_per_token : float = 4.0, keep_contexts : int = 1, trim_ratio : float = 0.6):
+        super().__init__()
+        self.max_tokens = max_tokens
+        self.chars_per_token = chars_per_token
+        self.keep_contexts = keep_contexts
+        self.trim_ratio = trim_ratio
+
+        # the estimated prompt tokens sent on every turn and the counts reported by the model
+        # (ollama only counts the tokens it didn't reuse from its cache)
+        self.prompt_tokens : list[int] = []
+        self.model_tokens : list[Optional[int]] = []
+
+        # the first message of the history after the system prompt which is still sent
+        self._start = 0
+
+    # a rough estimate (~4 characters per token for english and german text) plus the role tokens
+    def estimate(self, message : dict[str, str]) -> int:
+        return int(len(message["content"]) / self.chars_per_token) + 4
+
+    # a question with its retrieved context (see LLM_Client.context_last) only carries the context in its own turn
+    @staticmethod
+    def _prompt_message(message : dict[str, str], is_last : bool) -> dict[str, str]:
+        if "context" in message:
+            return {"role": message["role"], "content": message["context"] if is_last else message["content"]}
+
+        return message
+
+    # returns the messages to send for the current turn
+    def fit(self, history : list[dict[str, str]]) -> list[dict[str, str]]:
+        if len(history) == 0:
+            return []
+
+        head = history[:1] if history[0]["role"] == "system" and "sources" not in history[0] else []
+
+        # only the latest retrieved contexts are kept
+        contexts = [index for index in range(len(head), len(history)) if history[index]["role"] == "system" and "sources" in history[index]]
+        stale = set(contexts[:len(contexts) - self.keep_contexts] if self.keep_contexts > 0 else contexts)
+
+        # the history was cut back (e.g. a cancelled message)
+        if self._start >= len(history):
+            self._start = 0
+
+        indexes = [index for index in range(max(self._start, len(head)), len(history)) if index not in stale]
+        rest = [self._prompt_message(history[index], index == len(history) - 1) for index in indexes]
+
+        head_tokens = sum(self.estimate(message) for message in head)
+        sizes = [self.estimate(message) for message in rest]
+        total = sum(sizes)
+        start = 0
+
+        if len(rest) > 0 and head_tokens + total > self.max_tokens:
+            # dropping the oldest messages, the last one (the question) always stays
+            while start < len(rest) - 1 and head_tokens + total > self.max_tokens * self.trim_ratio:
+                total -= sizes[start]
+                start += 1
+
+            # a turn isn't cut in half
+            while 0 < start < len(rest) - 1 and rest[start]["role"] == "assistant":
+                total -= sizes[start]
+                start += 1
+
+            self._start = indexes[start]
+
+        messages = head + rest[start:]
+        self.prompt_tokens.append(head_tokens + total)
+        metrics.observe("llm_prompt_tokens", head_tokens + total)
+        self.model_tokens.append(None)
+        return messages
+
+    def report(self, prompt_tokens : int):
+        metrics.observe("llm_model_prompt_tokens", prompt_tokens)
+
+        if self.model_tokens:
+            self.model_tokens[-1] = prompt_tokens
+
+    def reset(self):
+        self.prompt_tokens = []
+        self.model_tokens = []
+        self._start = 0
@@ -1,21 +1,58 @@
-from .client import LLM_Client
-from ollama import Client, Options
-from retrieval.solr_handler import SolrHandler
+import threading
+from threading import Thread
+from .client import LLM_Client, AsyncLLM_Client, GenerationTimer
+from .history import HistoryManager
+from ollama import Client, AsyncClient, Options, ResponseError
+from retrieval.retriever import Retriever
+from retrieval.language_detector import LanguageDetector
 
 class OllamaClient(LLM_Client):
-    def __init__(self, host : str, model : str, solr : SolrHandler, insertion_format = None, use_explicit_query = False):
-        super().__init__(solr, insertion_format, use_explicit_query)
+    # one connection pool per server and a single warm-up per model and process, shared by every session
+    _connections : dict[str, Client] = {}
+    _warmed_models : set[tuple[str, str]] = set()
+    _shared_lock = threading.Lock()
+
+    """
+    keep_alive: how long ollama keeps the model loaded after a request (e.g. "30m", -1 forever, None for the server default)
+    history: the token budget of the prompt (3000 tokens by default, see history.py)
+    """
+    def __init__(self, host : str, model : str, solr : Retriever, insertion_format = None, use_explicit_query = False, context_last = True, keep_alive = "30m", detector : LanguageDetector = None, history : HistoryManager = None):
+        super().__init__(solr, insertion_format, use_explicit_query, detector, history, context_last)
         #* you could add relevant options based on this article: https://medium.com/@auslei/how-to-use-ollamas-generate-and-chat-functions-4f90eac8d0fd
         # options = Options()
 
-        self.client = Client(host=host)
+        self.client = self.connection(host)
         self.model = model
+        self.keep_alive = keep_alive
+
+        self._warm_up(host, model, keep_alive)
+
+    # the client is thread safe, so the sessions can share its connections
+    @classmethod
+    def connection(cls, host : str) -> Client:
+        with cls._shared_lock:
+            if host not in cls._connections:
+                cls._connections[host] = Client(host=host)
+            return cls._connections[host]
+
+    # loads the model in the background, so the first question doesn't wait for it
+    @classmethod
+    def _warm_up(cls, host : str, model : str, keep_alive):
+        with cls._shared_lock:
+            if (host, model) in cls._warmed_models:
+                return
+            cls._warmed_models.add((host, model))
+
+        def load():
+            try:
+                # a chat without messages only loads the model
+                cls.connection(host).chat(model=model, messages=[], keep_alive=keep_alive)
+            except ResponseError as error:
+                print(f"Couldn't load {model}: {error.error}. Try `docker exec -it ollama_docker ollama pull {model}`")
+            except Exception as error:
+                print(f"Couldn't reach the ollama server: {error}")
 
-        # check if the model is running
-        running : list[dict] = self.client.ps()['models']
-        
-        if sum(model in r['name'] for r in running) == 0:
-            print(f"This model isn't running! Try `docker exec -it ollama_docker ollama run {model}`")
+        Thread(target=load, daemon=True).start()
 
     def new_message(self, message : str):
         should_run_query =  self.should_run_query(message)
@@ -28,15 +65,58 @@ class OllamaClient(LLM_Client):
         if should_run_query:
             self.run_query()
 
-        stream = self.client.chat(model=self.model, messages=self.message_history, stream=True)
+        timer = GenerationTimer(self.model)
+        stream = self.client.chat(model=self.model, messages=self.prompt_messages(), stream=True, keep_alive=self.keep_alive)
 
         response = []
 
         for chunk in stream:
             content = chunk['message']['content']
 
+            # the last chunk has the prompt size counted by the model
+            if chunk.get('prompt_eval_count'):
+                self.history.report(chunk['prompt_eval_count'])
+
+            if content:
+                timer.token()
+
+            if chunk.get('done'):
+                timer.finish(chunk.get('eval_count'), (chunk.get('eval_duration') or 0) / 1e9)
+
             # Yield all content (llama3.2 doesn't need header filtering)
             response.append(content)
             yield content
 
-        self.message_history.append({"role": "assistant", "content": "".join(response)})
\ No newline at end of file
+        self.message_history.append({"role": "assistant", "content": "".join(response)})
+
+class AsyncOllamaClient(AsyncLLM_Client):
+    def __init__(self, host : str, model : str, solr : Retriever, insertion_format = None, use_explicit_query = False, context_last = True, keep_alive = "30m", detector : LanguageDetector = None, history : HistoryManager = None):
+        super().__init__(solr, insertion_format, use_explicit_query, detector, history, context_last)
+
+        self.client = AsyncClient(host=host)
+        self.model = model
+        self.keep_alive = keep_alive
+
+    # a chat without messages only loads the model, so it is ready when the retrieval finishes
+    async def warm_up(self):
+        await self.client.chat(model=self.model, messages=[], keep_alive=self.keep_alive)
+
+    async def _stream(self, messages : list[dict[str, str]]):
+        timer = GenerationTimer(self.model)
+        stream = await self.client.chat(model=self.model, messages=messages, stream=True, keep_alive=self.keep_alive)
+
+        try:
+            async for chunk in stream:
+                if chunk.get('prompt_eval_count'):
+                    self.history.report(chunk['prompt_eval_count'])
+
+                if chunk['message']['content']:
+                    timer.token()
+
+                if chunk.get('done'):
+                    timer.finish(chunk.get('eval_count'), (chunk.get('eval_duration') or 0) / 1e9)
+
+                yield chunk['message']['content']
+        finally:
+            # stops reading the answer of an abandoned request
+            await stream.aclose()
@@ -1,14 +1,28 @@
-from .client import LLM_Client
-from openai import OpenAI
-from retrieval.solr_handler import SolrHandler
+import threading
+from .client import LLM_Client, AsyncLLM_Client, GenerationTimer
+from .history import HistoryManager
+from openai import OpenAI, AsyncOpenAI
+from retrieval.retriever import Retriever
+from retrieval.language_detector import LanguageDetector
 
 class OpenAI_Client(LLM_Client):
-    def __init__(self, api_key: str, model: str, solr: SolrHandler, insertion_format=None, use_explicit_query=False):
-        super().__init__(solr, insertion_format, use_explicit_query)
+    # one connection pool per api key, shared by every session of the process
+    _connections: dict[str, OpenAI] = {}
+    _shared_lock = threading.Lock()
 
-        self.openai = OpenAI(api_key=api_key)
+    def __init__(self, api_key: str, model: str, solr: Retriever, insertion_format=None, use_explicit_query=False, context_last=True, detector: LanguageDetector = None, history: HistoryManager = None):
+        super().__init__(solr, insertion_format, use_explicit_query, detector, history, context_last)
+
+        self.openai = self.connection(api_key)
         self.model = model
 
+    @classmethod
+    def connection(cls, api_key: str) -> OpenAI:
+        with cls._shared_lock:
+            if api_key not in cls._connections:
+                cls._connections[api_key] = OpenAI(api_key=api_key)
+            return cls._connections[api_key]
+
     def new_message(self, message: str):
         should_run_query = self.should_run_query(message)
 
@@ -21,21 +35,70 @@ class OpenAI_Client(LLM_Client):
             self.run_query()
 
         response = []
+        timer = GenerationTimer(self.model)
 
         stream = self.openai.chat.completions.create(
             model=self.model,
             messages=[
                 # removing sources
-                {"role": m["role"], "content": m["content"]} for m in self.message_history
+                {"role": m["role"], "content": m["content"]} for m in self.prompt_messages()
             ],
-            stream=True
+            stream=True,
+            stream_options={"include_usage": True}
         )
 
         for chunk in stream:
+            # the usage comes in a last chunk without choices
+            if chunk.usage:
+                self.history.report(chunk.usage.prompt_tokens)
+                timer.finish(chunk.usage.completion_tokens)
+
+            if not chunk.choices:
+                continue
+
             content = chunk.choices[0].delta.content
             
             if content:
+                timer.token()
                 response.append(content)
                 yield content 
 
         self.message_history.append({"role": "assistant", "content": "".join(response)})
+
+
+class AsyncOpenAI_Client(AsyncLLM_Client):
+    def __init__(self, api_key: str, model: str, solr: Retriever, insertion_format=None, use_explicit_query=False, context_last=True, detector: LanguageDetector = None, history: HistoryManager = None):
+        super().__init__(solr, insertion_format, use_explicit_query, detector, history, context_last)
+
+        self.openai = AsyncOpenAI(api_key=api_key)
+        self.model = model
+
+    async def _stream(self, messages: list[dict[str, str]]):
+        timer = GenerationTimer(self.model)
+        stream = await self.openai.chat.completions.create(
+            model=self.model,
+            messages=[
+                # removing sources
+                {"role": m["role"], "content": m["content"]} for m in messages
+            ],
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    self.history.report(chunk.usage.prompt_tokens)
+                    timer.finish(chunk.usage.completion_tokens)
+
+                if not chunk.choices:
+                    continue
+
+                content = chunk.choices[0].delta.content
+
+                if content:
+                    timer.token()
+                    yield content
+        finally:
+            # closes the connection of an abandoned request
+            await stream.close()
@@ -5,27 +5,61 @@ from os.path import join
 from dotenv import load_dotenv
 from typing import Literal
 
-# load OllamaClient
-def init_client():
+# loading the environment variables and the packages once per process
+@st.cache_resource
+def prepare():
     current_dir = os.path.dirname(__file__)
     load_dotenv(join(current_dir, '..', '.env'))
     
     for dir in ["retrieval", "LLM"]:
         sys.path.append(join(current_dir, "..", dir))
 
-    from retrieval import SolrHandler
-    from LLM import OllamaClient, OpenAI_Client
+    # METRICS, METRICS_JSONL and METRICS_PORT turn on the timing of the chat (see retrieval/metrics.py)
+    from retrieval.metrics import Metrics
+    Metrics.shared().enable_from_env()
+
+# the retriever is shared by every session of the process (the indexes, caches and connections are thread safe)
+@st.cache_resource
+def load_retriever():
+    from retrieval import SolrHandler, BM25Index, DenseIndex, HybridRetriever
+
+    index_dir = os.environ.get("LOCAL_INDEX", join(os.path.dirname(__file__), "..", "index"))
+
+    # RETRIEVER=local uses the index built by `--upload --engine local` instead of solr
+    if os.environ.get("RETRIEVER", "solr") == "local":
+        solr_handler = BM25Index.load(index_dir)
+    else:
+        # LANGUAGE_FALLBACK: how the english documents are searched for the other languages (see solr_handler.py)
+        # SNIPPETS: the number of highlighted fragments returned instead of the whole texts (0 = whole texts)
+        solr_handler = SolrHandler(
+            os.environ.get("SOLR_SERVER"),
+            os.environ.get("CORE_NAME"),
+            language_fallback=os.environ.get("LANGUAGE_FALLBACK", "parallel"),
+            snippets=int(os.environ.get("SNIPPETS", "0"))
+        )
+
+    # HYBRID=true fuses the results with the dense index built by `--upload --dense`
+    if os.environ.get("HYBRID", "false").lower() == "true":
+        solr_handler = HybridRetriever(solr_handler, DenseIndex.load(index_dir))
+
+    return solr_handler
+
+# load OllamaClient, the session only keeps its conversation (the LLM connections are pooled by the clients)
+def init_client():
+    from LLM import OllamaClient, OpenAI_Client, HistoryManager
+
+    solr_handler = load_retriever()
 
-    solr_handler = SolrHandler(
-        os.environ.get("SOLR_SERVER"),
-        os.environ.get("CORE_NAME")
-    )
+    # MAX_PROMPT_TOKENS: the token budget of the prompt, the older turns are dropped above it (e.g. more for large context models)
+    history = HistoryManager(max_tokens=int(os.environ.get("MAX_PROMPT_TOKENS", "3000")))
 
-    client = OllamaClient(os.environ.get("OLLAMA_SERVER"), os.environ.get("OLLAMA_MODEL"), solr_handler)
-    #client = OpenAI_Client(os.environ.get("OPENAI_API_KEY"), os.environ.get("OPENAI_MODEL"), solr_handler)
+    client = OllamaClient(os.environ.get("OLLAMA_SERVER"), os.environ.get("OLLAMA_MODEL"), solr_handler, history=history)
+    #client = OpenAI_Client(os.environ.get("OPENAI_API_KEY"), os.environ.get("OPENAI_MODEL"), solr_handler, history=history)
 
     st.session_state["client"] = client
 
+prepare()
+
 # State handling
 if 'initialized' not in st.session_state:
     init_client()
@@ -83,12 +117,10 @@ if prompt := st.chat_input("Say something"):
         with st.chat_message("assistant"):
             response = st.write_stream(st.session_state.client.new_message(prompt))
 
-        sources = []
-        if "sources" in st.session_state.client.message_history[-2]:
-            sources = st.session_state.client.message_history[-2]["sources"]
+        sources = st.session_state.client.last_sources()
 
-            if len(sources) > 0:
-                with st.expander("Data sources", False):
-                    st.write("\n".join(sources))
+        if len(sources) > 0:
+            with st.expander("Data sources", False):
+                st.write("\n".join(sources))
 
         add_message(response, "ai", sources)
@@ -3,10 +3,17 @@ from os.path import join, exists
 from dotenv import load_dotenv
 import sys
 import argparse
-from retrieval import Downloader, SolrHandler
-from retrieval.filters import DataFilter, MicrosoftDocFilter, WikiFilter, DbFilter
+from retrieval import Downloader, SolrHandler, Retriever, BM25Index, DenseIndex, HybridRetriever
+from retrieval.filters import DataFilter, MicrosoftDocFilter, WikiFilter, DbFilter, FilterExecutor
+from retrieval.filter_cache import FilterCache
 import subprocess
 from typing import Optional, Sequence
+from concurrent.futures import ThreadPoolExecutor, Executor
+from queue import Queue
+from threading import Thread
+from retrieval.documents import make_record, read_folder
+from retrieval.chunker import PassageChunker
+from retrieval.metrics import Metrics
 
 def main (main_args  : Optional[Sequence[str]] = None):
     project_dir = os.path.dirname(__file__)
@@ -14,11 +21,19 @@ def main (main_args  : Optional[Sequence[str]] = None):
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--download', help='Download data', action='store_true', default=False)
+    parser.add_argument('--force-download', help='Download every file again, ignoring the validators of the download manifest (it is still updated)', action='store_true', default=False)
     parser.add_argument('--filter', help='Filter data', action='store_true', default=False)
+    parser.add_argument('--jobs', help='Number of worker processes used for filtering', type=int, default=1)
+    parser.add_argument('--no-cache', help='Filter every file again instead of reusing the unchanged outputs', action='store_true', default=False)
+    parser.add_argument('--pipeline', help='Upload the documents straight from the filters without writing the filtered files', action='store_true', default=False)
+    parser.add_argument('--passages', help='Index the documents as overlapping passages', action='store_true', default=False)
+    parser.add_argument('--engine', help='Where the documents are indexed: the solr server or a local index file', choices=['solr', 'local'], default='solr')
+    parser.add_argument('--dense', help='Also build the offline dense index (in index/) for hybrid retrieval', action='store_true', default=False)
     parser.add_argument('--keep-data', help='Keep the filtered data ater upload', action='store_true', default=False)
     parser.add_argument('--upload', help='Upload data', action='store_true', default=False)
     parser.add_argument('--process-data', help='Only run the first 3 steps without launching the UI', action='store_true', default=False)
     parser.add_argument('--ui', help='Start the UI', action='store_true', default=False)
+    parser.add_argument('--metrics', help='Time the steps of the run and append the measurements to this jsonl file (a summary is printed at the end)', default=None)
     parser.add_argument('--all', help='Run all the steps', action='store_true', default=False)
 
     if(main_args is None or len(main_args) == 0):
@@ -33,10 +48,18 @@ def main (main_args  : Optional[Sequence[str]] = None):
     data_dir = join(project_dir, 'data')
 
     url_for_id = {}
+    metrics = Metrics.shared()
+
+    if args.metrics:
+        metrics.enable(args.metrics)
+    else:
+        # the prometheus endpoint is served by the UI process
+        metrics.enable_from_env(serve=False)
     
     # Downloading data
     if args.download or args.process_data or args.all:
-        url_for_id = download_data(data_dir)
+        with metrics.span("stage", stage="download"):
+            url_for_id = download_data(data_dir, force=args.force_download)
         print("Downloaded data")
 
         # save the urls for later use
@@ -56,26 +79,45 @@ def main (main_args  : Optional[Sequence[str]] = None):
     subfolder_processors = {
         "microsoft": MicrosoftDocFilter('Gilt für:'),
         "wiki": WikiFilter(url_for_id),
-        "db": DbFilter()
+        # the large pdfs are extracted by the same number of processes
+        "db": DbFilter(workers=args.jobs)
     }
 
     # Filter data
     filtered_dir = join(project_dir, 'filtered')
+    run_filter = args.filter or args.process_data or args.all
+    run_upload = args.upload or args.process_data or args.all
+    cache = None if args.no_cache else FilterCache(join(project_dir, '.cache', 'filter'))
+    chunker = PassageChunker() if args.passages else None
+
+    index_dir = join(project_dir, 'index')
+
+    # Filter and upload in one pass
+    if args.pipeline and run_filter and run_upload:
+        retriever = create_retriever(args.engine, args.dense)
+
+        with metrics.span("stage", stage="pipeline"):
+            run_pipeline(retriever, data_dir, filtered_dir if args.keep_data else None, subfolder_processors, url_for_id, cache, args.jobs, chunker)
+        save_retriever(retriever, index_dir)
+        print("Filtered and uploaded data")
+        del retriever
+
+        run_filter = run_upload = False
 
-    if args.filter or args.process_data or args.all:
-        filter_data(data_dir, filtered_dir, subfolder_processors)
+    if run_filter:
+        with metrics.span("stage", stage="filter"):
+            filter_data(data_dir, filtered_dir, subfolder_processors, cache, args.jobs)
         print("Filtered data")
 
     # Upload data
-    if args.upload or args.process_data or args.all:
-        solr = SolrHandler(
-            os.environ.get('SOLR_SERVER'), 
-            os.environ.get('CORE_NAME')
-        )
+    if run_upload:
+        retriever = create_retriever(args.engine, args.dense)
         
-        upload_data(solr, filtered_dir, subfolder_processors.keys(), url_for_id)
+        with metrics.span("stage", stage="upload"):
+            upload_data(retriever, filtered_dir, subfolder_processors.keys(), url_for_id, chunker)
+        save_retriever(retriever, index_dir)
         print("Uploaded data")
-        del solr
+        del retriever
 
 
     # Clean up
@@ -90,6 +132,9 @@ def main (main_args  : Optional[Sequence[str]] = None):
     # free up memory
     del filtered_dir, subfolder_processors, data_dir
 
+    if metrics.enabled:
+        print(metrics.report())
+
     # Setting up chat client
     if args.ui or args.all:
         try:
@@ -107,32 +152,126 @@ def prepare(project_dir : str):
     for package in ['filtering', 'retrieval']:
         sys.path.append(join(project_dir, package))
 
-def download_data(data_dir : str) -> dict[str, str]:
+def download_data(data_dir : str, force : bool = False) -> dict[str, str]:
     if not exists(data_dir):
         print("Missing data folder")
         quit(-1)
 
-    return Downloader().download_data(data_dir)
+    return Downloader(force=force).download_data(data_dir)
 
-def filter_data(data_dir : str, filtered_dir : str, subfolders : dict[str, DataFilter]):
+def filter_data(data_dir : str, filtered_dir : str, subfolders : dict[str, DataFilter], cache : FilterCache = None, jobs : int = 1):
     if not exists(filtered_dir):
         os.mkdir(filtered_dir)
 
-    for folder, processor in subfolders.items():
-        processor.process_folder(
-            join(data_dir, folder),
-            join(filtered_dir, folder)
-        ) 
+    if jobs <= 1:
+        for folder, processor in subfolders.items():
+            processor.process_folder(
+                join(data_dir, folder),
+                join(filtered_dir, folder),
+                cache
+            ) 
+        return
+
+    # every folder submits its files to the same process pool, so the workers get files from all folders
+    with FilterExecutor(subfolders, max_workers=jobs) as pool, ThreadPoolExecutor(max_workers=len(subfolders)) as folders:
+        running = [
+            folders.submit(processor.process_folder, join(data_dir, folder), join(filtered_dir, folder), cache, pool)
+            for folder, processor in subfolders.items()
+        ]
 
-def upload_data(handler : SolrHandler, filtered_dir : str, subfolders : list[str], urls : dict[str, str]):
+        for future in running:
+            future.result()
+
+# solr or the local index (which is saved after the upload), optionally together with the dense index
+def create_retriever(engine : str, dense : bool = False) -> Retriever:
+    if engine == 'local':
+        retriever = BM25Index()
+    else:
+        retriever = SolrHandler(
+            os.environ.get('SOLR_SERVER'), 
+            os.environ.get('CORE_NAME')
+        )
+
+    return HybridRetriever(retriever, DenseIndex()) if dense else retriever
+
+def save_retriever(retriever : Retriever, index_dir : str):
+    if isinstance(retriever, HybridRetriever):
+        retriever.dense.save(index_dir)
+        retriever = retriever.lexical
+
+    if isinstance(retriever, BM25Index):
+        retriever.save(index_dir)
+
+def upload_data(handler : Retriever, filtered_dir : str, subfolders : list[str], urls : dict[str, str], chunker : PassageChunker = None):
     if not handler.is_available():
         quit(-1)
     
     for folder in subfolders:
-        handler.upload_forlder(
-            folder=join(filtered_dir, folder),
-            url_for_data=urls
-        )
+        folder_path = join(filtered_dir, folder)
+
+        if not exists(folder_path):
+            print(f"{folder_path} doesn't exist")
+            continue
+
+        handler.upload_records(read_folder(folder_path, urls), chunker)
+
+# filters the folders and pushes their document records into the queue (None marks the end of a folder)
+def _produce_records(queue : Queue, processor : DataFilter, folder : str, data_dir : str, sink_dir : Optional[str], url_for_id : dict[str, str], cache : FilterCache, executor : Optional[Executor]):
+    try:
+        output_path = join(sink_dir, folder) if sink_dir else None
+
+        for name, title, content in processor.iter_documents(join(data_dir, folder), cache, executor, output_path):
+            queue.put(make_record(name, title, content, folder, url_for_id))
+    except Exception as error:
+        print(f"Couldn't filter {folder}: {error}")
+    finally:
+        queue.put(None)
+
+def _consume_records(queue : Queue, producers : int):
+    finished = 0
+
+    while finished < producers:
+        record = queue.get()
+
+        if record is None:
+            finished += 1
+        else:
+            yield record
+
+"""
+filters the data and uploads the documents through a bounded queue, so filtering and uploading overlap
+the filtered files are only written if a sink directory is given
+"""
+def run_pipeline(handler : Retriever, data_dir : str, sink_dir : Optional[str], subfolders : dict[str, DataFilter], url_for_id : dict[str, str], cache : FilterCache = None, jobs : int = 1, chunker : PassageChunker = None, queue_size : int = 256):
+    if not handler.is_available():
+        quit(-1)
+
+    if sink_dir and not exists(sink_dir):
+        os.mkdir(sink_dir)
+
+    queue : Queue = Queue(maxsize=queue_size)
+    pool = FilterExecutor(subfolders, max_workers=jobs) if jobs > 1 else None
+
+    # with a single job the folders are filtered one after another
+    folder_groups = [[item] for item in subfolders.items()] if pool else [list(subfolders.items())]
+
+    def produce_group(group):
+        for folder, processor in group:
+            _produce_records(queue, processor, folder, data_dir, sink_dir, url_for_id, cache, pool)
+
+    producers = [Thread(target=produce_group, args=(group,), daemon=True) for group in folder_groups]
+
+    try:
+        for producer in producers:
+            producer.start()
+
+        handler.upload_records(_consume_records(queue, len(subfolders)), chunker)
+
+        for producer in producers:
+            producer.join()
+    finally:
+        if pool:
+            pool.shutdown()
 
 if __name__ == '__main__':
     main(sys.argv[1:])
\ No newline at end of file
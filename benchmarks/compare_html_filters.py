@@ -0,0 +1,84 @@
+"""
+compares the html backends of MicrosoftDocFilter and DbFilter (see retrieval/html_extractor.py)
+the outputs have to be the same as the ones of the old full parse ("soup"), the throughput is printed in pages/s
+
+python benchmarks/compare_html_filters.py                 # the downloaded pages in data/microsoft and data/db
+python benchmarks/compare_html_filters.py --synthetic 200 # generated pages (no download needed)
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from os.path import join, dirname, abspath, exists
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from bs4.builder import builder_registry
+from retrieval.filters import MicrosoftDocFilter, DbFilter
+from benchmarks.corpus import microsoft_page, db_page
+
+def write_synthetic(folder : str, count : int, seed : int = 0):
+    generator = random.Random(seed)
+
+    for subfolder in ["microsoft", "db"]:
+        os.makedirs(join(folder, subfolder), exist_ok=True)
+
+    for index in range(1, count + 1):
+        sections = generator.randint(3, 30)
+
+        with open(join(folder, "microsoft", f"microsoft_{index}"), "w", encoding="utf-8") as file:
+            file.write(microsoft_page(generator, index, sections))
+
+        # some of the db pages are windows-1250 encoded
+        with open(join(folder, "db", f"db_{index}"), "w", encoding="windows-1250" if index % 5 == 0 else "utf-8") as file:
+            file.write(db_page(generator, index, sections))
+
+def run(folder : str, repeat : int) -> int:
+    backends = ["soup", "strainer"] + (["lxml"] if builder_registry.lookup("lxml") else [])
+    filters = { "microsoft": lambda backend: MicrosoftDocFilter('Gilt für:', html_backend=backend), "db": lambda backend: DbFilter(html_backend=backend) }
+    code = 0
+
+    for subfolder, make_filter in filters.items():
+        if not exists(join(folder, subfolder)):
+            print(f"{join(folder, subfolder)} doesn't exist")
+            continue
+
+        paths = [join(folder, subfolder, name) for name in sorted(os.listdir(join(folder, subfolder))) if name != "urls.txt" and not name.lower().endswith(".pdf")]
+        outputs = {}
+
+        for backend in backends:
+            html_filter = make_filter(backend)
+            best = None
+
+            for _ in range(repeat):
+                start = time.perf_counter()
+                outputs[backend] = [html_filter._filter(path) for path in paths]
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+
+            different = sum(1 for old, new in zip(outputs["soup"], outputs[backend]) if old != new)
+            print(f"{subfolder} {backend}: {len(paths) / best:.1f} pages/s, {different} different outputs")
+
+            # lxml may parse broken html differently, only the html.parser backends have to match
+            if different and backend != "lxml":
+                code = 1
+
+    return code
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("folder", nargs="?", default=join(dirname(dirname(abspath(__file__))), "data"))
+    parser.add_argument("--synthetic", help="Compare on N generated pages per filter instead of the folder", type=int, default=0)
+    parser.add_argument("--repeat", help="Runs of each backend, the best time is printed", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.synthetic > 0:
+        with tempfile.TemporaryDirectory() as folder:
+            write_synthetic(folder, args.synthetic)
+            code = run(folder, args.repeat)
+    else:
+        code = run(args.folder, args.repeat)
+
+    sys.exit(code)
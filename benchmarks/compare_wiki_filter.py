@@ -0,0 +1,81 @@
+"""
+compares the single pass WikiFilter with the legacy one (two parses and a str.replace for every node)
+the outputs of both have to be the same, the time of both is printed
+
+python benchmarks/compare_wiki_filter.py                 # the downloaded articles in data/wiki
+python benchmarks/compare_wiki_filter.py --synthetic 200 # generated articles (no download needed)
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from os.path import join, dirname, abspath
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from retrieval.filters import WikiFilter
+from benchmarks.corpus import wiki_article
+
+# markup inside the extension tags which wikitextparser doesn't parse (the old filter replaced it after removing the tags)
+EXTENSION_TAG_CASES = [
+    "a <pre>code [[x]]</pre> b",
+    "<nowiki>[[Foo|bar]] {{lang|de|y}}</nowiki> z",
+    "x <math>a [[b]] <!-- c --></math>",
+    "<syntaxhighlight lang=python>print('[[x]]')</syntaxhighlight>",
+    "== A ==\n<pre>\n  code [[x|y]] '''b'''\n</pre>\ntext",
+    "<nowiki><b>[[x]]</b></nowiki>",
+    "<ref>see <nowiki>[[q]]</nowiki></ref> end",
+]
+
+def write_synthetic(folder : str, count : int, seed : int = 0):
+    generator = random.Random(seed)
+
+    for index, case in enumerate(EXTENSION_TAG_CASES):
+        with open(join(folder, f"case_{index + 1}"), "w", encoding="utf-8") as file:
+            file.write(case)
+
+    for index in range(count):
+        with open(join(folder, f"wiki_{index + 1}"), "w", encoding="utf-8") as file:
+            file.write(wiki_article(generator, generator.randint(2, 40)))
+
+def run(folder : str, repeat : int) -> int:
+    paths = [join(folder, name) for name in sorted(os.listdir(folder)) if name != "urls.txt"]
+    outputs = {}
+
+    for legacy in [True, False]:
+        wiki_filter = WikiFilter({}, legacy=legacy)
+        best = None
+
+        for _ in range(repeat):
+            start = time.perf_counter()
+            outputs[legacy] = [wiki_filter._filter(path) for path in paths]
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        print(f"{'legacy' if legacy else 'single pass'}: {best:.3f} s, {len(paths) / best:.1f} articles/s")
+
+    different = [path for path, old, new in zip(paths, outputs[True], outputs[False]) if old != new]
+
+    for path in different[:10]:
+        print(f"different output: {path}")
+
+    print(f"{len(paths) - len(different)}/{len(paths)} outputs are the same")
+    return 1 if different else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("folder", nargs="?", default=join(dirname(dirname(abspath(__file__))), "data", "wiki"))
+    parser.add_argument("--synthetic", help="Compare on N generated articles instead of the folder", type=int, default=0)
+    parser.add_argument("--repeat", help="Runs of each filter, the best time is printed", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.synthetic > 0:
+        with tempfile.TemporaryDirectory() as folder:
+            write_synthetic(folder, args.synthetic)
+            code = run(folder, args.repeat)
+    else:
+        code = run(args.folder, args.repeat)
+
+    sys.exit(code)
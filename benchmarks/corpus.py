@@ -0,0 +1,169 @@
+"""
+seeded synthetic corpus like the downloaded data: microsoft doc pages, wikitext articles, db pages and multi-page pdfs
+"""
+import os
+import random
+from os.path import join
+
+WORDS = "data server database table query index system user file network memory cache windows language model text page".split()
+GERMAN_WORDS = "daten server datenbank tabelle abfrage index system benutzer datei netzwerk speicher sprache seite".split()
+
+def sentence(generator : random.Random, length : int = 12, words : list[str] = WORDS) -> str:
+    return " ".join(generator.choice(words) for _ in range(length)).capitalize() + "."
+
+# the navigation, scripts and footer around the content, like on the real pages
+def _boilerplate(generator : random.Random) -> tuple[str, str]:
+    links = "".join(f'<li><a href="/{generator.choice(WORDS)}">{sentence(generator, 2)}</a></li>' for _ in range(150))
+    head = f'<head><title>x</title><script>var config = {{ "a": 1 }};</script><style>.a {{ color: red; }}</style></head><body><nav><ul>{links}</ul></nav>'
+    foot = f'<footer><ul>{links}</ul><p>{sentence(generator)}</p></footer></body>'
+    return head, foot
+
+def _html_body(generator : random.Random, sections : int) -> str:
+    return "".join(
+        f"<h2>{sentence(generator, 3)}</h2><p>{sentence(generator)} <b>{generator.choice(WORDS)}</b> {sentence(generator)}</p>"
+        f"<ul><li>{sentence(generator, 5)}</li><li><p>{sentence(generator, 4)}</p></li></ul>"
+        f"<table><tr><th>{generator.choice(WORDS)}</th><td>{sentence(generator, 3)}</td></tr></table>"
+        for _ in range(sections)
+    )
+
+def microsoft_page(generator : random.Random, index : int, sections : int) -> str:
+    head, foot = _boilerplate(generator)
+    return f"<html>{head}<div class='content'><h1> Title {index} </h1><p>Gilt für: Windows</p>{_html_body(generator, sections)}</div>{foot}</html>"
+
+def db_page(generator : random.Random, index : int, sections : int) -> str:
+    head, foot = _boilerplate(generator)
+    return f"<html>{head}<main><h1>Db Page {index}</h1><p>ő é á</p>{_html_body(generator, sections)}</main>{foot}</html>"
+
+def _wiki_paragraph(generator : random.Random, reference : int) -> str:
+    parts = []
+
+    for _ in range(generator.randint(3, 8)):
+        parts.append(sentence(generator))
+        kind = generator.randint(0, 9)
+
+        if kind == 0:
+            parts.append(f"[[{generator.choice(WORDS).capitalize()}|{generator.choice(WORDS)}s]]")
+        elif kind == 1:
+            parts.append(f"[[{generator.choice(WORDS).capitalize()} {generator.choice(WORDS)}]]")
+        elif kind == 2:
+            parts.append(f'<ref name="r{reference}">{{{{cite web|url=https://example.org/{reference}|title={sentence(generator, 4)}}}}}</ref>')
+        elif kind == 3:
+            parts.append(f'<ref name="r{reference}" />')
+        elif kind == 4:
+            parts.append(f"<!-- {sentence(generator, 5)} -->")
+        elif kind == 5:
+            parts.append(f"[https://example.org/{generator.choice(WORDS)} {sentence(generator, 3)}]")
+        elif kind == 6:
+            parts.append(f"{{{{lang|de|{generator.choice(WORDS)}}}}}")
+        elif kind == 7:
+            parts.append(f"'''{generator.choice(WORDS)}'''<br />")
+        elif kind == 8:
+            # the contents of these tags aren't parsed by wikitextparser, some of them have markup
+            tag = generator.choice(["pre", "nowiki", "math", "syntaxhighlight"])
+            markup = f" [[{generator.choice(WORDS)}]] {{{{lang|de|{generator.choice(WORDS)}}}}}" if generator.random() < 0.25 else ""
+            parts.append(f"<{tag}>{sentence(generator, 4)}{markup}</{tag}>")
+
+    return " ".join(parts)
+
+def _wiki_table(generator : random.Random) -> str:
+    rows = "".join(f"|-\n| [[{generator.choice(WORDS)}]] || {sentence(generator, 3)}\n" for _ in range(generator.randint(2, 6)))
+    return '{| class="wikitable"\n! Name !! Value\n' + rows + "|}"
+
+def wiki_article(generator : random.Random, sections : int) -> str:
+    infobox = "".join(f"| {name} = {value}\n" for name, value in [
+        ("name", generator.choice(WORDS).capitalize()),
+        ("developer", f"[[{generator.choice(WORDS).capitalize()} Corporation|{generator.choice(WORDS)}]]"),
+        ("released", f"{{{{Start date|{generator.randint(1990, 2020)}}}}}<ref>{sentence(generator, 4)}</ref>"),
+        ("genre", f"[[{generator.choice(WORDS)}]]<!-- {generator.choice(WORDS)} -->"),
+        ("website", "")
+    ])
+
+    text = [f"{{{{Short description|{sentence(generator, 5)}}}}}\n{{{{Infobox software\n{infobox}}}}}\n{_wiki_paragraph(generator, 0)}\n"]
+
+    for section in range(1, sections + 1):
+        text.append(f"\n== {sentence(generator, 2)[:-1]} ==\n{_wiki_paragraph(generator, section)}\n")
+
+        if generator.random() < 0.5:
+            text.append(f"\n=== {sentence(generator, 2)[:-1]} ===\n{_wiki_paragraph(generator, section)}\n\n{_wiki_table(generator)}\n")
+
+        text.append(f"* {sentence(generator, 4)}\n* [[{generator.choice(WORDS)}]]\n")
+
+    text.append("\n== See also ==\n* [[Other]]\n\n== References ==\n{{Reflist}}\n<references />\n\n== External links ==\n* [https://example.org Official website]\n")
+    return "".join(text)
+
+# a minimal pdf with one text stream per page (helvetica, no compression)
+def pdf_bytes(pages : list[str]) -> bytes:
+    out = [b"%PDF-1.4\n"]
+    offsets = {}
+    size = len(out[0])
+
+    def add(number : int, body : bytes):
+        nonlocal size
+        offsets[number] = size
+        chunk = f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+        out.append(chunk)
+        size += len(chunk)
+
+    page_numbers = [4 + 2 * index for index in range(len(pages))]
+    add(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+    add(2, f"<< /Type /Pages /Kids [{' '.join(f'{number} 0 R' for number in page_numbers)}] /Count {len(pages)} >>".encode())
+    add(3, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    for number, text in zip(page_numbers, pages):
+        stream = "BT /F1 10 Tf 50 750 Td 12 TL " + " ".join(f"({line}) '" for line in text.split("\n")) + " ET"
+        add(number, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {number + 1} 0 R >>".encode())
+        add(number + 1, f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream".encode())
+
+    total = max(offsets) + 1
+    xref = f"xref\n0 {total}\n0000000000 65535 f \n" + "".join(f"{offsets[number]:010d} 00000 n \n" for number in range(1, total))
+    out.append(xref.encode())
+    out.append(f"trailer\n<< /Size {total} /Root 1 0 R >>\nstartxref\n{size}\n%%EOF\n".encode())
+    return b"".join(out)
+
+def pdf_document(generator : random.Random, page_count : int) -> bytes:
+    return pdf_bytes(["\n".join(sentence(generator) for _ in range(generator.randint(5, 40))) for _ in range(page_count)])
+
+"""
+writes the pages of the corpus under site_dir/<folder>/ like a web site and returns the relative paths of every folder
+(the db folder also gets the pdfs, some db pages are windows-1250 encoded)
+"""
+def write_site(site_dir : str, pages : int, sections : int, pdfs : int, pdf_pages : int, seed : int = 0) -> dict[str, list[str]]:
+    generator = random.Random(seed)
+    paths : dict[str, list[str]] = { "microsoft": [], "wiki": [], "db": [] }
+
+    for folder in paths:
+        os.makedirs(join(site_dir, folder), exist_ok=True)
+
+    for index in range(1, pages + 1):
+        page_sections = generator.randint(max(1, sections // 3), sections)
+
+        paths["microsoft"].append(f"microsoft/page_{index}.html")
+        with open(join(site_dir, paths["microsoft"][-1]), "w", encoding="utf-8") as file:
+            file.write(microsoft_page(generator, index, page_sections))
+
+        paths["wiki"].append(f"wiki/Article_{index}")
+        with open(join(site_dir, paths["wiki"][-1]), "w", encoding="utf-8") as file:
+            file.write(wiki_article(generator, page_sections))
+
+        paths["db"].append(f"db/page_{index}.html")
+        with open(join(site_dir, paths["db"][-1]), "w", encoding="windows-1250" if index % 5 == 0 else "utf-8") as file:
+            file.write(db_page(generator, index, page_sections))
+
+    for index in range(1, pdfs + 1):
+        paths["db"].append(f"db/manual_{index}.pdf")
+        with open(join(site_dir, paths["db"][-1]), "wb") as file:
+            file.write(pdf_document(generator, pdf_pages))
+
+    return paths
+
+# generated (query, language) pairs in english and german, some of them match nothing in the corpus
+def queries(count : int, seed : int = 0) -> list[tuple[str, str]]:
+    generator = random.Random(seed)
+    pairs = []
+
+    for index in range(count):
+        language = "de" if index % 3 == 0 else "en"
+        text = sentence(generator, generator.randint(3, 8), GERMAN_WORDS if language == "de" else WORDS)
+        pairs.append((text[:-1] + "?", language))
+
+    return pairs
@@ -0,0 +1,200 @@
+"""
+local stand-ins of the external services, they run on threads of the benchmark process
+"""
+import re
+import json
+import time
+import threading
+from functools import partial
+from collections import Counter
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler, BaseHTTPRequestHandler
+
+class _QuietFileHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+class _Server:
+    def __init__(self, handler):
+        super().__init__()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def host(self) -> str:
+        return f"127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+class FileServer(_Server):
+    """
+    serves a directory over http (with Last-Modified, so the downloader can revalidate)
+    """
+    def __init__(self, directory : str):
+        super().__init__(partial(_QuietFileHandler, directory=directory))
+
+class FakeSolr(_Server):
+    """
+    in-memory solr core: json updates, ping and an edismax-like select over the qf fields
+    the score of a document is the number of the query words in its fields, multiplied by the boosts of the fields
+    with hl=true the sentences with the most query words are returned as the highlighted fragments
+    delay: the time every select takes (like the round trip to a remote server)
+    """
+    TOKEN = re.compile(r'\w+')
+
+    def __init__(self, delay : float = 0.0):
+        self.delay = delay
+        self.docs : dict[str, dict] = {}
+        # id -> field -> word counts
+        self.terms : dict[str, dict[str, Counter]] = {}
+        # (id, field) -> (text, sentences with their words)
+        self.split_texts : dict[tuple[str, str], tuple[str, list[tuple[str, set[str]]]]] = {}
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        # the bytes of the responses by endpoint
+        self.sent = Counter()
+        super().__init__(self._handler())
+
+    def _index(self, doc : dict):
+        counts = { field: Counter(self.TOKEN.findall(str(value).lower())) for field, value in doc.items() if field == "title" or field.startswith("text_") }
+
+        with self.lock:
+            self.docs[doc["id"]] = doc
+            self.terms[doc["id"]] = counts
+
+    def _delete(self, command : dict):
+        with self.lock:
+            ids = command.get("id", [])
+            ids = ids if isinstance(ids, list) else [ids]
+
+            # the passage uploads delete by parent_id:(...)
+            for parent in re.findall(r'"([^"]+)"', command.get("query", "")):
+                ids += [id for id, doc in self.docs.items() if doc.get("parent_id") == parent]
+
+            for id in ids:
+                self.docs.pop(id, None)
+                self.terms.pop(id, None)
+
+    def select(self, params : dict[str, str]) -> dict:
+        words = self.TOKEN.findall(params.get("q", "").lower())
+        rows = int(params.get("rows", "10"))
+        fields = [field for field in params.get("fl", "").split(",") if field]
+        boosts = [(field.partition("^")[0], float(field.partition("^")[2] or 1)) for field in params.get("qf", "title text_en").split()]
+
+        if self.delay > 0:
+            time.sleep(self.delay)
+
+        with self.lock:
+            scored = [
+                (sum(boost * counts[field][word] for field, boost in boosts if field in counts for word in words), id)
+                for id, counts in self.terms.items()
+            ]
+
+        scored = sorted((item for item in scored if item[0] > 0), key=lambda item: (-item[0], item[1]))[:rows]
+        docs = []
+
+        for score, id in scored:
+            doc = self.docs[id]
+            docs.append({ field: doc[field] for field in fields if field in doc } | { "id": id, "score": float(score) })
+
+        response = { "responseHeader": { "status": 0 }, "response": { "numFound": len(scored), "docs": docs } }
+
+        if params.get("hl") == "true":
+            response["highlighting"] = { id: self._highlight(self.docs[id], words, params) for _, id in scored }
+
+        return response
+
+    SENTENCE = re.compile(r'[^.!?\n]+[.!?]?')
+
+    # the sentences of a stored field with their words, split once per document (like the offsets of a real index)
+    def _sentences(self, id : str, field : str, text : str) -> list[tuple[str, set[str]]]:
+        cached = self.split_texts.get((id, field))
+
+        # a re-indexed document is split again
+        if cached is None or cached[0] != text:
+            cached = (text, [(sentence.strip(), set(self.TOKEN.findall(sentence.lower()))) for sentence in self.SENTENCE.findall(text) if sentence.strip()])
+            self.split_texts[(id, field)] = cached
+
+        return cached[1]
+
+    def _highlight(self, doc : dict, words : list[str], params : dict[str, str]) -> dict[str, list[str]]:
+        snippets = int(params.get("hl.snippets", "1"))
+        size = int(params.get("hl.fragsize", "100"))
+        fields = {}
+
+        for field in params.get("hl.fl", "").split(","):
+            if field not in doc:
+                continue
+
+            sentences = self._sentences(doc["id"], field, str(doc[field]))
+            matches = [(-sum(word in tokens for word in words), index) for index, (_, tokens) in enumerate(sentences)]
+            best = sorted(index for score, index in sorted(matches)[:snippets] if score < 0)
+
+            if best:
+                fields[field] = [sentences[index][0][:size] for index in best]
+            elif params.get("hl.defaultSummary") == "true":
+                fields[field] = [str(doc[field])[:size]]
+
+        return fields
+
+    def _handler(self):
+        solr = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, data : dict):
+                body = json.dumps(data).encode("utf-8")
+                solr.sent[self._endpoint()] += len(body)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _params(self, query : str) -> dict[str, str]:
+                return { key: values[-1] for key, values in parse_qs(query).items() }
+
+            # the last part of the path (pysolr adds a trailing slash)
+            def _endpoint(self) -> str:
+                return urlparse(self.path).path.rstrip("/").rsplit("/", 1)[-1]
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                solr.requests[self._endpoint()] += 1
+
+                if self._endpoint() == "select":
+                    return self._send(solr.select(self._params(url.query)))
+
+                self._send({ "responseHeader": { "status": 0 }, "status": "OK" })
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+                if self._endpoint() == "select":
+                    solr.requests["select"] += 1
+                    return self._send(solr.select(self._params(body.decode("utf-8"))))
+
+                solr.requests["update"] += 1
+
+                if body.startswith(b"["):
+                    for doc in json.loads(body):
+                        solr._index(doc)
+                elif body.startswith(b"{"):
+                    command = json.loads(body)
+
+                    if "delete" in command:
+                        solr._delete(command["delete"])
+                elif body.startswith(b"<delete>"):
+                    solr._delete({ "query": body.decode("utf-8"), "id": re.findall(r'<id>([^<]+)</id>', body.decode("utf-8")) })
+
+                self._send({ "responseHeader": { "status": 0 } })
+
+        return Handler
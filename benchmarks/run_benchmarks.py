@@ -0,0 +1,203 @@
+"""
+times the stages of the system on a generated corpus, against local stand-ins of the web sites and solr (no network needed)
+download, the filters, the solr upload, the search and the retrieval of LLM_Client.run_query (no model is called)
+the results are saved as json, with --baseline the stages slower than the baseline by more than the threshold fail the run
+
+python benchmarks/run_benchmarks.py --output base.json
+python benchmarks/run_benchmarks.py --output new.json --baseline base.json --threshold 0.25
+"""
+import io
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import subprocess
+import contextlib
+from os.path import join, dirname, abspath
+
+sys.path.append(dirname(dirname(abspath(__file__))))
+
+from retrieval import Downloader, SolrHandler
+from retrieval.solr_handler import LANGUAGE_FALLBACKS
+from retrieval.filters import MicrosoftDocFilter, WikiFilter, DbFilter
+from LLM.client import LLM_Client
+from benchmarks.corpus import write_site, queries
+from benchmarks.fakes import FileServer, FakeSolr
+
+#* (pages per folder, max sections per page, pdfs, pages per pdf, queries)
+SIZES = {
+    "small":  (20, 10, 2, 40, 50),
+    "medium": (200, 20, 4, 200, 200),
+    "large":  (1000, 30, 8, 500, 500),
+}
+
+def _result(seconds : float, items : int, latencies : list[float] = None) -> dict:
+    result = { "seconds": round(seconds, 6), "items": items, "per_second": round(items / seconds, 3) if seconds > 0 else 0.0 }
+
+    if latencies:
+        latencies = sorted(latencies)
+        result["mean_ms"] = round(1000 * sum(latencies) / len(latencies), 3)
+        result["p50_ms"] = round(1000 * latencies[len(latencies) // 2], 3)
+        result["p95_ms"] = round(1000 * latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3)
+
+    return result
+
+def _timed(function, *args) -> tuple[float, object]:
+    start = time.perf_counter()
+    value = function(*args)
+    return time.perf_counter() - start, value
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=dirname(abspath(__file__)), capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+def run(size : str, seed : int, repeat : int, language_fallback : str = "parallel", solr_delay : float = 0.0, snippets : int = 0) -> dict:
+    pages, sections, pdfs, pdf_pages, query_count = SIZES[size]
+    results = {}
+
+    with tempfile.TemporaryDirectory() as temp, FileServer(join(temp, "site")) as server, FakeSolr(solr_delay) as solr:
+        site_dir, data_dir, filtered_dir = join(temp, "site"), join(temp, "data"), join(temp, "filtered")
+        paths = write_site(site_dir, pages, sections, pdfs, pdf_pages, seed)
+
+        for folder, folder_paths in paths.items():
+            os.makedirs(join(data_dir, folder))
+            os.makedirs(join(filtered_dir, folder))
+
+            with open(join(data_dir, folder, "urls.txt"), "w", encoding="utf-8") as file:
+                file.write("".join(f"http://{server.host}/{path}\n" for path in folder_paths))
+
+        files = sum(len(folder_paths) for folder_paths in paths.values())
+
+        # the second download only revalidates the files (304 Not Modified)
+        seconds, url_for_id = _timed(Downloader().download_data, data_dir)
+        results["download"] = _result(seconds, files)
+        seconds, _ = _timed(Downloader().download_data, data_dir)
+        results["download_revalidate"] = _result(seconds, files)
+
+        filters = { "microsoft": MicrosoftDocFilter('Gilt für:'), "wiki": WikiFilter(url_for_id), "db": DbFilter() }
+
+        # the best of the repeats, every run filters all the files again (no cache)
+        for folder, processor in filters.items():
+            seconds = min(_timed(processor.process_folder, join(data_dir, folder), join(filtered_dir, folder))[0] for _ in range(repeat))
+            results[f"filter/{type(processor).__name__}"] = _result(seconds, len(paths[folder]))
+
+        handler = SolrHandler(solr.host, "bench", cache_size=0, language_fallback=language_fallback, snippets=snippets)
+        documents = sum(len(os.listdir(join(filtered_dir, folder))) for folder in filters)
+        start = time.perf_counter()
+
+        for folder in filters:
+            handler.upload_forlder(join(filtered_dir, folder), url_for_id)
+
+        results["upload"] = _result(time.perf_counter() - start, documents)
+
+        pairs = queries(query_count, seed)
+        latencies = [_timed(handler.search, query, language)[0] for query, language in pairs]
+        results["search"] = _result(sum(latencies), len(pairs), latencies)
+
+        # the retrieval part of a chat turn: language detection, search and the prompt
+        client = LLM_Client(handler)
+        latencies = []
+
+        for query, _ in pairs:
+            client.new_chat("Tutor")
+            client.message_history.append({ "role": "user", "content": query })
+            latencies.append(_timed(client.run_query)[0])
+
+        results["run_query"] = _result(sum(latencies), len(pairs), latencies)
+        results["solr_requests"] = dict(solr.requests)
+        results["solr_response_bytes"] = dict(solr.sent)
+
+    return results
+
+"""
+returns the stages which got slower than the baseline by more than the threshold
+the per query stages are compared by their median latency, it is less noisy than the total time
+"""
+def compare(results : dict, baseline : dict, threshold : float) -> list[str]:
+    regressions = []
+
+    for stage, result in results.items():
+        previous = baseline.get(stage)
+        metric = "p50_ms" if "p50_ms" in result else "seconds"
+
+        if not isinstance(previous, dict) or previous.get(metric, 0) <= 0:
+            continue
+
+        ratio = result[metric] / previous[metric]
+        mark = "REGRESSION" if ratio > 1 + threshold else ""
+        print(f"{stage:<28} {metric:<8} {previous[metric]:>10.3f} -> {result[metric]:>10.3f}  x{ratio:.2f} {mark}")
+
+        if mark:
+            regressions.append(stage)
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", choices=list(SIZES), default="small")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", help="Runs of every filter, the best one is kept", type=int, default=3)
+    parser.add_argument("--language-fallback", help="The english fallback of the search (see retrieval/solr_handler.py)", choices=LANGUAGE_FALLBACKS, default="parallel")
+    parser.add_argument("--solr-delay", help="Seconds every search request of the fake solr takes", type=float, default=0.0)
+    parser.add_argument("--snippets", help="Highlighted fragments per document instead of the whole texts (0 = whole texts)", type=int, default=0)
+    parser.add_argument("--output", help="Where the results are saved", default=join(dirname(abspath(__file__)), "benchmark_results.json"))
+    parser.add_argument("--baseline", help="Results of an earlier run to compare with")
+    parser.add_argument("--threshold", help="Allowed slowdown of a stage compared to the baseline (0.25 = 25%%)", type=float, default=0.25)
+    parser.add_argument("--verbose", help="Show the output of the benchmarked code", action="store_true", default=False)
+    args = parser.parse_args()
+
+    output = io.StringIO()
+    with contextlib.redirect_stdout(sys.stdout if args.verbose else output):
+        results = run(args.size, args.seed, max(1, args.repeat), args.language_fallback, args.solr_delay, args.snippets)
+
+    report = {
+        "meta": {
+            "size": args.size,
+            "seed": args.seed,
+            "language_fallback": args.language_fallback,
+            "solr_delay": args.solr_delay,
+            "snippets": args.snippets,
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+
+    for stage, result in results.items():
+        if "seconds" in result:
+            latency = f"  p50 {result['p50_ms']}ms p95 {result['p95_ms']}ms" if "p95_ms" in result else ""
+            print(f"{stage:<28} {result['seconds']:>10.3f}s {result['per_second']:>12.1f}/s{latency}")
+
+    print(f"Saved {args.output}")
+
+    if not args.baseline:
+        return
+
+    with open(args.baseline, encoding="utf-8") as file:
+        baseline = json.load(file)
+
+    if baseline["meta"].get("size") != args.size or baseline["meta"].get("seed") != args.seed:
+        print("The baseline was made with a different size or seed, the results aren't comparable")
+        sys.exit(2)
+
+    regressions = compare(results, baseline["results"], args.threshold)
+
+    if regressions:
+        print(f"{len(regressions)} stages are slower than the baseline: {', '.join(regressions)}")
+        sys.exit(1)
+
+    print("No regressions")
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,6 @@
 from .downloader import Downloader
-from .solr_handler import SolrHandler
\ No newline at end of file
+from .retriever import Retriever
+from .solr_handler import SolrHandler
+from .bm25_index import BM25Index
+from .dense_index import DenseIndex
+from .hybrid import HybridRetriever
\ No newline at end of file
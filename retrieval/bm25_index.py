@@ -0,0 +1,220 @@
+import re
+import math
+import heapq
+import os
+from array import array
+from collections import Counter
+from typing import Iterable, Tuple
+from .retriever import Retriever
+from .query_normalizer import QueryNormalizer
+from .index_format import write_bm25, write_doc_store, new_build_id, MappedFile, DocStore, BM25_MAGIC, BM25_HEADER
+
+class BM25Scorer(Retriever):
+    """
+    BM25 ranking over an inverted index, the storage of the index is up to the subclasses
+    the title counts title_weight times (like title^2 in the solr query)
+    """
+    TOKEN = re.compile(r'\w+')
+
+    def __init__(self, normalizer : QueryNormalizer = None, k1 : float = 1.2, b : float = 0.75, min_score : float = 0.0):
+        super().__init__()
+        self.normalizer = normalizer if normalizer else QueryNormalizer.shared()
+        self.k1 = k1
+        self.b = b
+        self.min_score = min_score
+
+    # returns the document ids and the term frequencies of a term
+    def _postings(self, term : str) -> Tuple[Iterable[int], Iterable[int]]:
+        return [], []
+
+    def _document_count(self) -> int:
+        return 0
+
+    def _document_length(self, doc : int) -> int:
+        return 0
+
+    def _average_length(self) -> float:
+        return 1.0
+
+    # returns the stored document record
+    def _document(self, doc : int) -> dict:
+        return {}
+
+    def _rank(self, clear_query : str, top_n : int) -> list[Tuple[float, int]]:
+        count = self._document_count()
+        average_length = max(self._average_length(), 1e-9)
+        scores : dict[int, float] = {}
+
+        for term in set(clear_query.split()):
+            docs, frequencies = self._postings(term)
+
+            if len(docs) == 0:
+                continue
+
+            idf = math.log(1 + (count - len(docs) + 0.5) / (len(docs) + 0.5))
+
+            for doc, frequency in zip(docs, frequencies):
+                norm = self.k1 * (1 - self.b + self.b * self._document_length(doc) / average_length)
+                scores[doc] = scores.get(doc, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+
+        # the lower document index wins between equal scores
+        best = heapq.nsmallest(top_n, ((-score, doc) for doc, score in scores.items() if score > self.min_score))
+        return [(-score, doc) for score, doc in best]
+
+    def search_documents(self, query : str, language : str, top_n : int = 10, confidence : float = 1.0) -> list[dict]:
+        language = self._route_language(language, confidence)
+        clear_query = self.normalizer.normalize(query, language)
+        ranked = self._rank(clear_query, top_n)
+
+        found = []
+
+        for score, doc in ranked:
+            record = self._document(doc)
+            found_doc = { "id": record["id"], "title": record["title"], "text": record["body"], "url": record.get("url", ""), "score": score }
+
+            if "parent_id" in record:
+                found_doc["parent_id"] = record["parent_id"]
+
+            found.append(found_doc)
+
+        return found
+
+class BM25Index(BM25Scorer):
+    """
+    in-process inverted index built from the document records, a drop-in alternative to solr
+    """
+    def __init__(self, normalizer : QueryNormalizer = None, k1 : float = 1.2, b : float = 0.75, min_score : float = 0.0, title_weight : int = 2):
+        super().__init__(normalizer, k1, b, min_score)
+        self.title_weight = title_weight
+
+        # term -> (document indexes, term frequencies)
+        self.postings : dict[str, Tuple[array, array]] = {}
+        self.lengths = array('I')
+        self.documents : list[dict] = []
+        self._total_length = 0
+
+    def _term_counts(self, record : dict) -> Counter:
+        counts = Counter(self.TOKEN.findall(record["body"].lower()))
+
+        for token in self.TOKEN.findall(record["title"].lower()):
+            counts[token] += self.title_weight
+
+        return counts
+
+    def add(self, record : dict):
+        doc = len(self.documents)
+        counts = self._term_counts(record)
+
+        for term, frequency in counts.items():
+            if term not in self.postings:
+                self.postings[term] = (array('I'), array('I'))
+
+            docs, frequencies = self.postings[term]
+            docs.append(doc)
+            frequencies.append(frequency)
+
+        length = sum(counts.values())
+        self.lengths.append(length)
+        self._total_length += length
+
+        # only the fields needed for the answers are kept
+        self.documents.append({ key: record[key] for key in ["id", "title", "body", "url", "parent_id"] if key in record })
+
+    def upload_records(self, records : Iterable[dict], chunker = None, **upload_options):
+        if chunker:
+            records = (passage for record in records for passage in chunker.chunk(record))
+
+        for record in records:
+            self.add(record)
+
+    def _postings(self, term):
+        return self.postings.get(term, ((), ()))
+
+    def _document_count(self):
+        return len(self.documents)
+
+    def _document_length(self, doc):
+        return self.lengths[doc]
+
+    def _average_length(self):
+        return self._total_length / len(self.documents) if self.documents else 1.0
+
+    def _document(self, doc):
+        return self.documents[doc]
+
+    # writes the index in the binary format (see index_format.py) into the directory
+    def save(self, directory : str):
+        os.makedirs(directory, exist_ok=True)
+        build_id = new_build_id()
+
+        write_doc_store(os.path.join(directory, "docs.bin"), self.documents, build_id)
+        write_bm25(os.path.join(directory, "bm25.bin"), self.postings, self.lengths, self.title_weight, build_id)
+
+    # opens a saved index with mmap, so the startup doesn't depend on the size of the index
+    @staticmethod
+    def load(directory : str, **options) -> "MappedBM25Index":
+        return MappedBM25Index(directory, **options)
+
+class MappedBM25Index(BM25Scorer):
+    """
+    read-only BM25 index served straight from the memory mapped files of BM25Index.save
+    """
+    def __init__(self, directory : str, normalizer : QueryNormalizer = None, k1 : float = 1.2, b : float = 0.75, min_score : float = 0.0):
+        super().__init__(normalizer, k1, b, min_score)
+        self.directory = directory
+
+        self.file = MappedFile(os.path.join(directory, "bm25.bin"), BM25_MAGIC, BM25_HEADER)
+        self.documents = DocStore(os.path.join(directory, "docs.bin"))
+
+        (_, _, self.title_weight, self.document_count, self.term_count, self.total_length, posting_count, build_id,
+            term_offsets, term_blob, posting_starts, posting_docs, posting_frequencies, lengths) = self.file.header
+
+        # the two files are replaced one after the other, a load in between would get the documents of another save
+        if build_id != self.documents.build_id:
+            raise ValueError(f"The files of the index in {directory} are from different saves (it is being saved right now?), load it again")
+
+        self.term_offsets = self.file.numbers("Q", term_offsets, self.term_count + 1)
+        self.term_blob = term_blob
+        self.posting_starts = self.file.numbers("Q", posting_starts, self.term_count + 1)
+        self.posting_docs = self.file.numbers("I", posting_docs, posting_count)
+        self.posting_frequencies = self.file.numbers("I", posting_frequencies, posting_count)
+        self.lengths = self.file.numbers("I", lengths, self.document_count)
+
+    def _term(self, index : int) -> bytes:
+        return bytes(self.file.bytes_at(self.term_blob + self.term_offsets[index], self.term_blob + self.term_offsets[index + 1]))
+
+    # binary search in the sorted term table
+    def _find_term(self, term : str) -> int:
+        key = term.encode("utf-8")
+        low, high = 0, self.term_count
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self._term(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low if low < self.term_count and self._term(low) == key else -1
+
+    def _postings(self, term):
+        index = self._find_term(term)
+
+        if index < 0:
+            return (), ()
+
+        start, end = self.posting_starts[index], self.posting_starts[index + 1]
+        return self.posting_docs[start:end], self.posting_frequencies[start:end]
+
+    def _document_count(self):
+        return self.document_count
+
+    def _document_length(self, doc):
+        return self.lengths[doc]
+
+    def _average_length(self):
+        return self.total_length / self.document_count if self.document_count else 1.0
+
+    def _document(self, doc):
+        return self.documents[doc]
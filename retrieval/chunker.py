@@ -0,0 +1,75 @@
+import re
+from typing import Generator
+
+class PassageChunker:
+    """
+    splits the body of a document record into overlapping passages along the paragraphs (lines)
+    a passage is at most max_chars long, the next one repeats at most overlap characters of it
+    """
+    PARAGRAPH = re.compile(r'[^\n]+')
+
+    def __init__(self, max_chars : int = 800, overlap : int = 150):
+        super().__init__()
+        self.max_chars = max_chars
+        self.overlap = overlap
+
+    # paragraph spans, the ones longer than the budget are cut at whitespace
+    def _pieces(self, body : str) -> list[tuple[int, int]]:
+        pieces = []
+
+        for match in self.PARAGRAPH.finditer(body):
+            start, end = match.span()
+
+            while end - start > self.max_chars:
+                cut = body.rfind(' ', start + 1, start + self.max_chars)
+                cut = cut if cut > start else start + self.max_chars
+                pieces.append((start, cut))
+                start = cut
+
+            pieces.append((start, end))
+
+        return pieces
+
+    # returns the (start, end) offsets of the passages in the body
+    def split(self, body : str) -> list[tuple[int, int]]:
+        pieces = self._pieces(body)
+        spans = []
+        first = 0
+
+        while first < len(pieces):
+            start = pieces[first][0]
+            last = first
+
+            while last + 1 < len(pieces) and pieces[last + 1][1] - start <= self.max_chars:
+                last += 1
+
+            end = pieces[last][1]
+            spans.append((start, end))
+
+            if last + 1 >= len(pieces):
+                break
+
+            # the next passage starts with the last paragraphs which fit into the overlap
+            following = last + 1
+            while following - 1 > first and end - pieces[following - 1][0] <= self.overlap:
+                following -= 1
+
+            first = following
+
+        return spans
+
+    def chunk(self, record : dict) -> Generator[dict, None, None]:
+        body = record["body"]
+
+        # documents without a body still get a (title only) passage
+        spans = self.split(body) or [(0, 0)]
+
+        for number, (start, end) in enumerate(spans, start=1):
+            yield {
+                **record,
+                "id": f"{record['id']}#{number}",
+                "body": body[start:end],
+                "parent_id": record["id"],
+                "offset_start": start,
+                "offset_end": end
+            }
@@ -0,0 +1,221 @@
+import os
+import re
+import json
+import zlib
+import math
+import numpy as np
+from collections import Counter
+from typing import Iterable, Tuple
+from .index_format import write_doc_store, DocStore
+
+class HashingEmbedder:
+    """
+    offline, CPU only text vectors: the words and their character n-grams are hashed into a fixed number of dimensions
+    the character n-grams also match the inflected and compound forms (e.g. german and hungarian words)
+    """
+    TOKEN = re.compile(r'\w+')
+
+    def __init__(self, dim : int = 1024, ngram_range : Tuple[int, int] = (3, 5), max_chars : int = 4000):
+        super().__init__()
+        self.dim = dim
+        self.ngram_range = ngram_range
+        self.max_chars = max_chars
+
+    def _features(self, text : str) -> Counter:
+        features = Counter()
+
+        for word in self.TOKEN.findall(text[:self.max_chars].lower()):
+            features[word] += 1
+            padded = f"<{word}>"
+
+            for size in range(self.ngram_range[0], self.ngram_range[1] + 1):
+                for start in range(len(padded) - size + 1):
+                    features[padded[start:start + size]] += 1
+
+        return features
+
+    # sublinear term frequencies in the hashed space (crc32 is stable between processes unlike hash())
+    def counts(self, text : str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+
+        for feature, count in self._features(text).items():
+            code = zlib.crc32(feature.encode('utf-8'))
+            sign = 1.0 if code & 0x80000000 else -1.0
+            vector[code % self.dim] += sign * (1.0 + math.log(count))
+
+        return vector
+
+    def config(self) -> dict:
+        return { "dim": self.dim, "ngram_range": list(self.ngram_range), "max_chars": self.max_chars }
+
+class DenseIndex:
+    """
+    contiguous float32 matrix of normalized tf-idf vectors searched with batched dot products
+    with an IVF quantiser only the vectors of the nearest clusters are scored
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, embedder : HashingEmbedder = None, min_similarity : float = 0.1, nprobe : int = 8, batch_rows : int = 65536):
+        super().__init__()
+        self.embedder = embedder if embedder else HashingEmbedder()
+        self.min_similarity = min_similarity
+        self.nprobe = nprobe
+        self.batch_rows = batch_rows
+
+        self.vectors : np.ndarray = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self.idf : np.ndarray = np.ones(self.embedder.dim, dtype=np.float32)
+        self.documents = []
+
+        # ivf: centroids, the documents ordered by cluster and the start of every cluster
+        self.centroids : np.ndarray = None
+        self.list_order : np.ndarray = None
+        self.list_offsets : np.ndarray = None
+
+        self._pending : list[np.ndarray] = []
+
+    def add(self, record : dict):
+        self._pending.append(self.embedder.counts(record["title"] + "\n" + record["body"]))
+        self.documents.append({ key: record[key] for key in ["id", "title", "body", "url", "parent_id"] if key in record })
+
+    # same interface as the retrievers, so the index can be built from the upload stream
+    def upload_records(self, records : Iterable[dict], chunker = None, **upload_options):
+        if chunker:
+            records = (passage for record in records for passage in chunker.chunk(record))
+
+        for record in records:
+            self.add(record)
+
+    # computes the idf weights and the normalized matrix of the added documents (once all of them are added)
+    def finalize(self, ivf_threshold : int = 50000):
+        if not self._pending:
+            return
+
+        counts = np.vstack(self._pending)
+        self._pending = []
+
+        document_frequency = np.count_nonzero(counts, axis=0)
+        self.idf = np.log((1 + len(counts)) / (1 + document_frequency)).astype(np.float32) + 1.0
+
+        # in place, so the matrix isn't copied
+        counts *= self.idf
+        norms = np.linalg.norm(counts, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        counts /= norms
+        self.vectors = counts
+
+        if len(self.vectors) >= ivf_threshold:
+            self.train_ivf(int(np.sqrt(len(self.vectors))))
+
+    @staticmethod
+    def _normalize(vectors : np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).astype(np.float32)
+
+    # spherical k-means on a sample of the vectors
+    def train_ivf(self, lists : int, iterations : int = 10, sample : int = 20000, seed : int = 0):
+        random = np.random.default_rng(seed)
+        lists = max(1, min(lists, len(self.vectors)))
+        rows = self.vectors[random.choice(len(self.vectors), min(sample, len(self.vectors)), replace=False)]
+        centroids = rows[random.choice(len(rows), lists, replace=False)]
+
+        for _ in range(iterations):
+            assignment = np.argmax(rows @ centroids.T, axis=1)
+
+            for cluster in range(lists):
+                members = rows[assignment == cluster]
+
+                if len(members) > 0:
+                    centroids[cluster] = members.sum(axis=0)
+
+            centroids = self._normalize(centroids)
+
+        assignment = np.concatenate([np.argmax(batch @ centroids.T, axis=1) for batch in self._batches(self.vectors)])
+
+        self.centroids = centroids
+        self.list_order = np.argsort(assignment, kind='stable').astype(np.int64)
+        self.list_offsets = np.searchsorted(assignment[self.list_order], np.arange(lists + 1)).astype(np.int64)
+
+    def _batches(self, matrix : np.ndarray):
+        for start in range(0, len(matrix), self.batch_rows):
+            yield matrix[start:start + self.batch_rows]
+
+    def embed_query(self, query : str) -> np.ndarray:
+        return self._normalize(self.embedder.counts(query) * self.idf)
+
+    # returns the (document index, cosine similarity) pairs of the best documents
+    def search(self, query : str, top_n : int = 10) -> list[Tuple[int, float]]:
+        if len(self.vectors) == 0:
+            return []
+
+        vector = self.embed_query(query)
+
+        if self.centroids is not None:
+            probes = np.argsort(-(self.centroids @ vector))[:self.nprobe]
+            candidates = np.sort(np.concatenate([self.list_order[self.list_offsets[probe]:self.list_offsets[probe + 1]] for probe in probes]))
+            scores = self.vectors[candidates] @ vector
+        else:
+            candidates = None
+            scores = np.concatenate([batch @ vector for batch in self._batches(self.vectors)])
+
+        count = min(top_n, len(scores))
+
+        if count == 0:
+            return []
+
+        best = np.argpartition(-scores, count - 1)[:count]
+        best = best[np.argsort(-scores[best], kind='stable')]
+
+        found = []
+
+        for position in best:
+            if scores[position] < self.min_similarity:
+                break
+
+            doc = int(candidates[position]) if candidates is not None else int(position)
+            found.append((doc, float(scores[position])))
+
+        return found
+
+    def document(self, doc : int) -> dict:
+        return self.documents[doc]
+
+    def save(self, directory : str):
+        self.finalize()
+        os.makedirs(directory, exist_ok=True)
+
+        np.save(os.path.join(directory, "dense_vectors.npy"), self.vectors)
+        np.save(os.path.join(directory, "dense_idf.npy"), self.idf)
+
+        if self.centroids is not None:
+            np.save(os.path.join(directory, "dense_centroids.npy"), self.centroids)
+            np.save(os.path.join(directory, "dense_list_order.npy"), self.list_order)
+            np.save(os.path.join(directory, "dense_list_offsets.npy"), self.list_offsets)
+
+        write_doc_store(os.path.join(directory, "dense_docs.bin"), self.documents)
+
+        with open(os.path.join(directory, "dense.json"), 'w', encoding='utf-8') as file:
+            json.dump({ "version": self.FORMAT_VERSION, "embedder": self.embedder.config(), "ivf": self.centroids is not None }, file)
+
+    # the matrix is memory mapped, so it is shared between the processes
+    @classmethod
+    def load(cls, directory : str, **options) -> "DenseIndex":
+        with open(os.path.join(directory, "dense.json"), 'r', encoding='utf-8') as file:
+            meta = json.load(file)
+
+        if meta["version"] != cls.FORMAT_VERSION:
+            raise ValueError(f"The dense index in {directory} has version {meta['version']}, expected {cls.FORMAT_VERSION}. Rebuild the index")
+
+        config = meta["embedder"]
+        index = cls(HashingEmbedder(config["dim"], tuple(config["ngram_range"]), config["max_chars"]), **options)
+
+        index.vectors = np.load(os.path.join(directory, "dense_vectors.npy"), mmap_mode='r')
+        index.idf = np.load(os.path.join(directory, "dense_idf.npy"))
+        index.documents = DocStore(os.path.join(directory, "dense_docs.bin"))
+
+        if meta["ivf"]:
+            index.centroids = np.load(os.path.join(directory, "dense_centroids.npy"))
+            index.list_order = np.load(os.path.join(directory, "dense_list_order.npy"), mmap_mode='r')
+            index.list_offsets = np.load(os.path.join(directory, "dense_list_offsets.npy"))
+
+        return index
@@ -0,0 +1,63 @@
+"""
+document records passed from the filters to the indexers:
+{ "id": str, "title": str, "body": str, "url": str, "folder": str }
+"""
+import os
+import re
+from os.path import join
+from typing import Tuple, Generator
+
+# splits a "title\ncontent" text the same way as the filtered files are read back
+def split_document(text : str) -> Tuple[str, str]:
+    lines = text.splitlines()
+    return (lines[0] if lines else ""), "\n".join(lines[1:])
+
+PDF_PAGES = re.compile(r'(\d+)-(\d+)')
+
+# returns the source url of a document (split pdfs use the url of the whole pdf, opened at the first page of the part)
+def resolve_url(doc_id : str, url_for_data : dict[str, str]) -> str:
+    url = url_for_data[doc_id] if doc_id in url_for_data else ""
+
+    # handling split pdfs
+    if url == "":
+        name, _, part = doc_id.rpartition('_')
+        backup = name.lower() + ".pdf"
+        url = url_for_data[backup] if backup in url_for_data else ""
+
+        pages = PDF_PAGES.fullmatch(part)
+
+        if url != "" and pages:
+            url += f"#page={pages.group(1)}"
+
+    return url
+
+def make_record(doc_id : str, title : str, content : str, folder : str, url_for_data : dict[str, str]) -> dict:
+    # going through the same split as the files, so both ways index the same text
+    title, body = split_document(title + "\n" + content)
+
+    return {
+        "id": doc_id,
+        "title": title,
+        "body": body,
+        "url": resolve_url(doc_id, url_for_data),
+        "folder": folder
+    }
+
+# reads the filtered files of a folder one by one
+def read_folder(folder_path : str, url_for_data : dict[str, str]) -> Generator[dict, None, None]:
+    folder = os.path.basename(os.path.normpath(folder_path))
+
+    for filename in os.listdir(folder_path):
+        if filename == "urls.txt":
+            continue
+
+        with open(join(folder_path, filename), 'r', encoding='utf-8') as file:
+            title, body = split_document(file.read())
+
+        yield {
+            "id": filename,
+            "title": title,
+            "body": body,
+            "url": resolve_url(filename, url_for_data),
+            "folder": folder
+        }
@@ -1,38 +1,209 @@
 import requests
 import os
+import time
+import json
+import hashlib
+import threading
 from os.path import join, exists
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from .metrics import Metrics
+
+metrics = Metrics.shared()
+
+class DownloadManifest:
+    """
+    stores the validators (etag, last-modified), the content length and the content hash of every downloaded url
+    """
+    def __init__(self, path : str):
+        super().__init__()
+        self.path = path
+        self.entries : dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+        if exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as file:
+                    self.entries = json.load(file)
+            except (OSError, ValueError) as error:
+                print(f"Ignoring broken download manifest: {error}")
+
+    def get(self, url : str) -> dict:
+        with self._lock:
+            return self.entries.get(url, {})
+
+    def update(self, url : str, entry : dict):
+        with self._lock:
+            self.entries[url] = entry
+
+    def save(self):
+        # writing to a temporary file first, so an interrupted run can't corrupt the manifest
+        temp_path = self.path + ".tmp"
+
+        with self._lock:
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                json.dump(self.entries, file, indent=1)
+
+        os.replace(temp_path, self.path)
 
 class Downloader:
-    def _download(self, url : str, out : str, out_path : str) -> bool:
-        file_path = join(out_path, out)
+    FETCHED = "fetched"
+    UNCHANGED = "unchanged"
+    FAILED = "failed"
+
+    # status codes worth retrying (rate limiting and temporary server errors)
+    RETRY_STATUSES = { 429, 500, 502, 503, 504 }
+
+    def __init__(self, max_workers : int = 8, per_host_limit : int = 4, max_retries : int = 3, backoff : float = 1.0, timeout : float = 60, use_manifest : bool = True, force : bool = False):
+        super().__init__()
+        self.use_manifest = use_manifest
+        # download every file again, the manifest is still updated for the next runs
+        self.force = force
+        self.manifest : DownloadManifest = None
+        self.max_workers = max_workers
+        self.per_host_limit = per_host_limit
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        # a single pooled session, so the TCP/TLS connections are reused between the requests
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': 'Mozilla', 'Accept-Charset': 'utf-8'})
+
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max(max_workers, per_host_limit))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self._host_slots : dict[str, threading.Semaphore] = {}
+        self._host_lock = threading.Lock()
+
+        self.stats = { self.FETCHED: 0, self.UNCHANGED: 0, self.FAILED: 0 }
+        self._stats_lock = threading.Lock()
+
+    # limits the number of concurrent requests to the same host
+    def _host_slot(self, url : str) -> threading.Semaphore:
+        host = urlparse(url).netloc
+
+        with self._host_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.Semaphore(self.per_host_limit)
+            return self._host_slots[host]
+
+    # waiting time before the next attempt (uses the Retry-After header if the server sent one)
+    def _retry_delay(self, attempt : int, response : requests.Response = None) -> float:
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+
+            if retry_after.isdigit():
+                return float(retry_after)
+
+        return self.backoff * (2 ** attempt)
+
+    # headers which let the server answer with 304 if the file didn't change since the last run
+    def _conditional_headers(self, entry : dict, file_path : str) -> dict[str, str]:
+        headers = {}
+
+        # the ids can shift if urls.txt changes, so the validators only apply to the same file
+        if self.force or not entry or entry.get('file') != os.path.basename(file_path) or not exists(file_path):
+            return headers
+
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        return headers
+
+    # writes the body next to the target and only replaces the old file if the content changed
+    def _save_body(self, url : str, response : requests.Response, file_path : str, entry : dict) -> str:
+        temp_path = file_path + ".part"
+        digest = hashlib.sha256()
+        length = 0
 
         try:
-            headers = {'User-Agent': 'Mozilla', 'Accept-Charset': 'utf-8'}
-            response = requests.get(url=url, headers=headers)
-            response.raise_for_status()  # Check if the request was successful
-            response.encoding = 'utf-8'
-            
-            with open(file_path, "wb") as file:
+            with open(temp_path, "wb") as file:
                 for chunk in response.iter_content(chunk_size=8192):
                     file.write(chunk)
-            return True
+                    digest.update(chunk)
+                    length += len(chunk)
+        except BaseException:
+            # an interrupted body doesn't leave a truncated file for the filters
+            if exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        content_hash = digest.hexdigest()
+
+        if entry.get('sha256') == content_hash and entry.get('file') == os.path.basename(file_path) and exists(file_path):
+            os.remove(temp_path)
+            status = self.UNCHANGED
+        else:
+            os.replace(temp_path, file_path)
+            status = self.FETCHED
+
+        if self.manifest is not None:
+            self.manifest.update(url, {
+                'file': os.path.basename(file_path),
+                'etag': response.headers.get('ETag', ''),
+                'last_modified': response.headers.get('Last-Modified', ''),
+                'content_length': length,
+                'sha256': content_hash
+            })
+
+        return status
+
+    def _download(self, url : str, out : str, out_path : str) -> str:
+        file_path = join(out_path, out)
+        entry = self.manifest.get(url) if self.manifest is not None else {}
+        headers = self._conditional_headers(entry, file_path)
+
+        try:
+            for attempt in range(self.max_retries + 1):
+                with self._host_slot(url):
+                    response = self.session.get(url=url, headers=headers, timeout=self.timeout, stream=True)
+
+                    if response.status_code == 304:
+                        response.close()
+                        return self.UNCHANGED
+
+                    if response.status_code not in self.RETRY_STATUSES or attempt == self.max_retries:
+                        response.raise_for_status()  # Check if the request was successful
+                        response.encoding = 'utf-8'
+
+                        return self._save_body(url, response, file_path, entry)
+
+                    response.close()
+
+                # the slot is released while waiting, so other urls of the host can proceed
+                time.sleep(self._retry_delay(attempt, response))
         except requests.RequestException as error:
             print(f"Error downloading file: {error}")
-            return False
+            return self.FAILED
         except Exception as error:
             print(f"Error: {error}")
-            return False
+            return self.FAILED
 
-    def download_data(self, data_dir : str) -> dict[str, str]:
-        url_for_id = {}
+    def _download_job(self, job : tuple[str, str, str]) -> str:
+        with metrics.span("download_file", folder=os.path.basename(job[2])):
+            status = self._download(job[1], job[0], job[2])
+
+        with self._stats_lock:
+            self.stats[status] += 1
+
+        return status
+
+    # collects the (id, url, folder) jobs in the same order as the urls.txt files list them
+    def _collect_jobs(self, data_dir : str) -> list[tuple[str, str, str]]:
+        jobs = []
 
         for folder in os.listdir(data_dir):
             subdirectory = join(data_dir, folder)
             link_path = join(subdirectory, "urls.txt")
-            
+
             if not exists(link_path):
                 continue
-        
+
             i = 1
 
             with open(link_path, 'r', encoding='utf-8') as file:
@@ -47,9 +218,32 @@ class Downloader:
                         id = f"{url.split('/')[-1].lower()}"
                     else:
                         i += 1
-                    
-                    download_success = self._download(url, id, subdirectory)
-                    
-                    if download_success:
-                        url_for_id[id] = url
+
+                    jobs.append((id, url, subdirectory))
+
+        # if two urls write the same file, only the last one is kept (as a sequential run would do)
+        last_job = { (id, subdirectory): index for index, (id, _, subdirectory) in enumerate(jobs) }
+        return [job for index, job in enumerate(jobs) if last_job[(job[0], job[2])] == index]
+
+    def download_data(self, data_dir : str) -> dict[str, str]:
+        url_for_id = {}
+        jobs = self._collect_jobs(data_dir)
+
+        self.stats = { self.FETCHED: 0, self.UNCHANGED: 0, self.FAILED: 0 }
+
+        if self.use_manifest:
+            self.manifest = DownloadManifest(join(data_dir, "download_manifest.json"))
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(self._download_job, jobs)
+
+            # map keeps the order of the jobs, so the ids are in the same order as in a sequential run
+            for (id, url, _), status in zip(jobs, results):
+                if status != self.FAILED:
+                    url_for_id[id] = url
+
+        if self.manifest is not None:
+            self.manifest.save()
+
+        print(f"Downloads: {self.stats[self.FETCHED]} fetched, {self.stats[self.UNCHANGED]} unchanged, {self.stats[self.FAILED]} failed")
         return url_for_id
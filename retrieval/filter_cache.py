@@ -0,0 +1,121 @@
+import os
+import json
+import hashlib
+from os.path import join, exists
+from typing import Optional, Iterable, Iterator
+
+class CacheEntryWriter:
+    """
+    writes the outputs of a file one by one (a json line each), the entry only becomes visible when it is committed
+    """
+    def __init__(self, path : str):
+        super().__init__()
+        self.path = path
+        self.temp_path = path + ".tmp"
+        self.file = open(self.temp_path, 'w', encoding='utf-8')
+
+    def write(self, output : Iterable[str]):
+        self.file.write(json.dumps(list(output), ensure_ascii=False) + "\n")
+
+    def commit(self):
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    # drops the outputs of a file which couldn't be filtered
+    def discard(self):
+        self.file.close()
+
+        if exists(self.temp_path):
+            os.remove(self.temp_path)
+
+class FilterCache:
+    """
+    content addressed store for filter outputs, the key is built from the input file, its name, the filter class and its parameters
+    (the outputs are named after the input file, so two files with the same content can't share an entry)
+    the outputs of a file are stored as json lines, so they can be written and read one at a time (e.g. the parts of a large pdf)
+    """
+    def __init__(self, cache_dir : str):
+        super().__init__()
+        self.cache_dir = cache_dir
+
+        os.makedirs(join(cache_dir, "outputs"), exist_ok=True)
+
+    def key(self, path : str, filter_name : str, params : dict) -> str:
+        digest = hashlib.sha256()
+
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1 << 16), b''):
+                digest.update(chunk)
+
+        digest.update(os.path.basename(path).encode('utf-8'))
+        digest.update(filter_name.encode('utf-8'))
+        digest.update(json.dumps(params, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _output_path(self, key : str) -> str:
+        return join(self.cache_dir, "outputs", f"{key}.jsonl")
+
+    def _index_path(self, folder : str) -> str:
+        return join(self.cache_dir, f"index_{folder}.json")
+
+    # returns an iterator over the cached outputs as (output name, title, content) lists or None on a miss
+    def get(self, key : str) -> Optional[Iterator[list[str]]]:
+        path = self._output_path(key)
+
+        if not exists(path):
+            return None
+
+        return self._read_lines(path)
+
+    @staticmethod
+    def _read_lines(path : str) -> Iterator[list[str]]:
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                yield json.loads(line)
+
+    def writer(self, key : str) -> CacheEntryWriter:
+        # the entries were single json files before
+        legacy_path = join(self.cache_dir, "outputs", f"{key}.json")
+
+        if exists(legacy_path):
+            os.remove(legacy_path)
+
+        return CacheEntryWriter(self._output_path(key))
+
+    def put(self, key : str, outputs : Iterable):
+        writer = self.writer(key)
+
+        for output in outputs:
+            writer.write(output)
+
+        writer.commit()
+
+    def remove(self, key : str):
+        path = self._output_path(key)
+
+        if exists(path):
+            os.remove(path)
+
+    # the index maps the input file names of a folder to their keys from the previous run
+    def load_index(self, folder : str) -> dict[str, str]:
+        path = self._index_path(folder)
+
+        if not exists(path):
+            return {}
+
+        try:
+            with open(path, 'r', encoding='utf-8') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def save_index(self, folder : str, index : dict[str, str]):
+        self._write_json(self._index_path(folder), index)
+
+    def _write_json(self, path : str, data):
+        temp_path = path + ".tmp"
+
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, ensure_ascii=False)
+
+        os.replace(temp_path, path)
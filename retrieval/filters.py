@@ -1,31 +1,43 @@
 import os
 import re
+import time
+import multiprocessing
 from os.path import join, exists
-from pypdf import PdfReader
 import wikitextparser as wtp
 from bs4 import BeautifulSoup
-from typing import Tuple
+from typing import Tuple, Generator, Iterable
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from .filter_cache import FilterCache
+from .pdf_extractor import PdfExtractor
+from .wiki_rewriter import WikiRewriter
+from .html_extractor import HtmlExtractor, read_html
+from .metrics import Metrics
+
+metrics = Metrics.shared()
 
 class DataFilter:
+    #* increase it when the output of the filter changes, so the cached outputs get invalidated
+    version : int = 1
+
     # returns the title and the content of the article
     def _filter(self, file_path : str)  -> Tuple[str, str]:
         return "", ""
-    
-    # returns the text content of a pdf
-    def _get_pdf_content(self, path : str, max_pages : int = 10) -> list[str]:
-        reader = PdfReader(path)
-        i = 0
-        result : list[str] = [ "" ]
 
-        for page in reader.pages:
-            result[-1] += f"\n{page.extract_text()}"
-            i += 1
+    # returns the parameters which change the output of the filter for the given file
+    def _cache_params(self, filename : str) -> dict:
+        return {}
 
-            if(max_pages == i):
-                result.append("")
-                i = 0
+    """
+    returns the (output name, title, content) of every document made from the file
+    the executor of the filter is only given for the streamed files (see _is_streamed)
+    """
+    def _process_file(self, path : str, executor : Executor = None) -> Iterable[Tuple[str, str, str]]:
+        title, content = self._filter(path)
+        return [(os.path.basename(path), title, content)]
 
-        return result
+    # streamed files are processed in this process and their documents are passed on one by one (e.g. the parts of a large pdf)
+    def _is_streamed(self, filename : str) -> bool:
+        return False
 
     # generic html getter
     def _get_html_content(self, path : str) -> str:
@@ -35,61 +47,216 @@ class DataFilter:
 
 
     """
-    filters the input path and puts it to the output (creates the output folder if it is missing
+    filters the input path and yields the (output name, title, content) of every document in directory order
+    unchanged files reuse their previous output from the cache (if one is given)
+    with an executor the files are filtered by its workers, the order of the outputs stays the same
+    (a FilterExecutor which was made with this filter only gets the paths of the files, other executors get the whole filter with every file)
+    (the streamed files are processed here, they can use the executor for their own work)
+    with an output path the documents are also written there (creates the output folder if it is missing)
     """
-    def process_folder(self, input_path : str, output_path : str):
+    def iter_documents(self, input_path : str, cache : FilterCache = None, executor : Executor = None, output_path : str = None) -> Generator[Tuple[str, str, str], None, None]:
         if not exists(input_path):
             print(f"{input_path} doesn't exist so it can't be processed")
             return
         
-        if not exists(output_path):
+        if output_path and not exists(output_path):
             os.mkdir(output_path)
+
+        folder = os.path.basename(os.path.normpath(input_path))
+        in_workers = isinstance(executor, FilterExecutor) and executor.filters.get(folder) is self
+        filter_name = f"{folder}/{type(self).__name__}:{self.version}"
+
+        previous_index = cache.load_index(folder) if cache else {}
+        index : dict[str, str] = {}
+        produced : set[str] = set()
+        jobs : list[tuple] = []
+        reused = 0
+        failed = 0
         
         for filename in os.listdir(input_path):
-            if filename == "urls.txt":
+            # the .part files are unfinished downloads (see downloader.py)
+            if filename == "urls.txt" or filename.endswith(".part"):
                 continue
             
             path = join(input_path, filename)
-    
-            title, content = self._filter(path)
+            key = None
+            outputs = None
+
+            if cache:
+                key = cache.key(path, filter_name, self._cache_params(filename))
+                outputs = cache.get(key)
+
+            if outputs is not None:
+                reused += 1
+            elif in_workers and not self._is_streamed(filename):
+                outputs = executor.submit(_filter_in_worker, folder, path)
+            elif executor and not self._is_streamed(filename):
+                outputs = executor.submit(_filter_file, self, path)
+
+            jobs.append((filename, path, key, outputs))
+
+        # nothing is timed while the metrics are off
+        timed = metrics.enabled
+
+        for filename, path, key, outputs in jobs:
+            is_new = outputs is None or isinstance(outputs, Future)
+            entry = cache.writer(key) if cache and is_new else None
+            seconds = 0.0
+
+            # a broken file is reported and skipped, so it can't abort the whole run
+            # (the documents of a streamed file which were already passed on are kept)
+            try:
+                if outputs is None:
+                    # the non-streamed files are filtered right here
+                    start = time.perf_counter() if timed else 0.0
+                    outputs = iter(self._process_file(path, executor))
+
+                    if timed:
+                        seconds += time.perf_counter() - start
+                elif isinstance(outputs, Future):
+                    outputs, seconds = outputs.result()
+                    outputs = iter(outputs)
+
+                while True:
+                    # only the filtering is timed, not the consumer of the documents
+                    if timed:
+                        start = time.perf_counter()
+                        output = next(outputs, None)
+                        seconds += time.perf_counter() - start
+                    else:
+                        output = next(outputs, None)
+
+                    if output is None:
+                        break
+
+                    name, title, content = output
+                    produced.add(name)
+
+                    if entry:
+                        entry.write(output)
+
+                    if output_path:
+                        with open(join(output_path, name), 'w', encoding="utf-8") as file:
+                            file.write(title + "\n" + content)
+
+                    yield name, title, content
+            except Exception as error:
+                print(f"Couldn't filter {path}: {error}")
+                failed += 1
+
+                if entry:
+                    entry.discard()
+                continue
+
+            if is_new and timed:
+                metrics.observe("filter_file_seconds", seconds, filter=type(self).__name__)
+
+            if cache:
+                if entry:
+                    entry.commit()
+                index[filename] = key
 
-            with open(join(output_path, filename), 'w', encoding="utf-8") as file:
-                file.write(title + "\n" + content)
+        if cache:
+            # dropping the outputs of changed and deleted files
+            live_keys = set(index.values())
+            for key in set(previous_index.values()) - live_keys:
+                cache.remove(key)
+
+            cache.save_index(folder, index)
+
+            deleted = len(set(previous_index) - set(job[0] for job in jobs))
+            print(f"{folder}: {len(index) - reused} filtered, {reused} unchanged, {deleted} deleted, {failed} failed")
+        elif failed > 0:
+            print(f"{folder}: {failed} files couldn't be filtered")
+
+        # removing the outputs of deleted files (when the filtered data was kept)
+        if output_path:
+            for name in os.listdir(output_path):
+                if name not in produced:
+                    os.remove(join(output_path, name))
+
+    """
+    filters the input path and puts it to the output (creates the output folder if it is missing
+    """
+    def process_folder(self, input_path : str, output_path : str, cache : FilterCache = None, executor : Executor = None):
+        for _ in self.iter_documents(input_path, cache, executor, output_path):
+            pass
+
+# runs a filter on a single file and returns its outputs with the time it took (module level function, so it can be sent to worker processes)
+def _filter_file(processor : DataFilter, path : str) -> Tuple[list[Tuple[str, str, str]], float]:
+    start = time.perf_counter()
+    outputs = list(processor._process_file(path))
+    return outputs, time.perf_counter() - start
+
+# the filters of a worker process of a FilterExecutor by their folder, set once when the worker starts
+_worker_filters : dict[str, DataFilter] = {}
+
+def _init_worker(filters : dict[str, DataFilter]):
+    _worker_filters.update(filters)
+
+def _filter_in_worker(folder : str, path : str) -> Tuple[list[Tuple[str, str, str]], float]:
+    return _filter_file(_worker_filters[folder], path)
+
+class FilterExecutor(ProcessPoolExecutor):
+    """
+    process pool for the filters of the folders, every worker gets the filters once when it starts,
+    so a task is only the folder and the path of a file (and not the whole filter, e.g. the urls of the wiki filter)
+    the workers are spawned, forking a process with running threads (the folders, the uploads of the pipeline) can deadlock
+    """
+    def __init__(self, filters : dict[str, DataFilter], max_workers : int = None):
+        super().__init__(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker, initargs=(filters,))
+        self.filters = filters
 
 class MicrosoftDocFilter(DataFilter):
-    def __init__(self, start_phrase : str):
+    """
+    html_backend: how the pages are parsed (see html_extractor.py)
+    """
+    def __init__(self, start_phrase : str, html_backend : str = "strainer"):
         super().__init__()
         self.start_phrase = start_phrase
+        self.html_backend = html_backend
+        self.extractor = HtmlExtractor('div', {'class': 'content'}, html_backend)
+
+    def _cache_params(self, filename):
+        return { "start_phrase": self.start_phrase, "html_backend": self.html_backend }
     
     def _filter(self, path):
-        with open(path, encoding='utf-8') as file:
-            soup = BeautifulSoup(file, 'html.parser', from_encoding="utf-8")
-
-            # finding html elements by their tags
-            article_div = soup.find('div', attrs={'class': 'content'})
+        # finding html elements by their tags
+        article_div = self.extractor.find_root(read_html(path))
 
-            title = article_div.find('h1').text.strip()
-            text_containers = article_div.find_all(['p', 'li', 'td', 'th', 'h2', 'h3' ])
+        title = article_div.find('h1').text.strip()
+        text_containers = article_div.find_all(['p', 'li', 'td', 'th', 'h2', 'h3' ])
 
-            # only using data after 'start phrase ...' (removes unnecessarry data)
-            has_started = False
+        # only using data after 'start phrase ...' (removes unnecessarry data)
+        has_started = False
 
-            # uniting all the text content into a single string
-            text_content = []
+        # uniting all the text content into a single string
+        text_content = []
 
-            for element in text_containers:
-                if has_started:
-                    text_content.append(element.text.strip())
-                else:
-                    has_started = element.text.strip().startswith(self.start_phrase)
+        for element in text_containers:
+            if has_started:
+                text_content.append(element.text.strip())
+            else:
+                has_started = element.text.strip().startswith(self.start_phrase)
 
-            return title, "\n".join(text_content)
+        return title, "\n".join(text_content)
 
 class WikiFilter(DataFilter):
-    def __init__(self, urls_for_id : dict[str, str] = {}):
+    # the single pass rewriter (the contents of the unparsed extension tags are rewritten like in the old filter)
+    version = 2
+
+    """
+    legacy: use the old filter (two parses and a str.replace for every node) instead of the single pass rewriter, for comparison
+    """
+    def __init__(self, urls_for_id : dict[str, str] = {}, legacy : bool = False):
         super().__init__()
         self.urls_for_id = urls_for_id
         self.keep_external_links = True
+        self.legacy = legacy
+
+    def _cache_params(self, filename):
+        # the title comes from the url of the file
+        return { "keep_external_links": self.keep_external_links, "url": self.urls_for_id.get(filename, ""), "legacy": self.legacy }
 
     def _handle_template(self, template) -> str:
         name : str = template.name.lower()
@@ -102,107 +269,122 @@ class WikiFilter(DataFilter):
             
         return ''
 
+    # same as _handle_template, with the arguments already rendered by the WikiRewriter
+    def _render_template(self, name : str, arguments : list[tuple[str, str, str, bool]]) -> str:
+        name = name.lower()
+
+        if name == 'short description':
+            return f'({arguments[0][2]})\n'
+
+        if name.startswith('infobox'):
+            return ''.join([f'{arg_name.strip()}: {value}' for arg_name, value, _, has_value in arguments if arg_name and has_value])
+
+        return ''
+
+    def _title(self, file_name : str) -> str:
+        # Extract title from URL or use filename
+        title = file_name.capitalize()
+        if file_name in self.urls_for_id:
+            url = self.urls_for_id[file_name]
+            # Try to extract from query parameter
+            title_match = re.findall(r'title=([^&]+)', url)
+            if title_match:
+                title = title_match[0]
+            else:
+                # Extract from /wiki/Article_name format
+                wiki_match = re.findall(r'/wiki/([^?#]+)', url)
+                if wiki_match:
+                    title = wiki_match[0].replace('_', ' ')
+
+        return title
+
     def _filter(self, path):
         with open(path, encoding='utf-8') as file:
-            file_name = os.path.basename(path)
-
-            # Extract title from URL or use filename
-            title = file_name.capitalize()
-            if file_name in self.urls_for_id:
-                url = self.urls_for_id[file_name]
-                # Try to extract from query parameter
-                title_match = re.findall(r'title=([^&]+)', url)
-                if title_match:
-                    title = title_match[0]
-                else:
-                    # Extract from /wiki/Article_name format
-                    wiki_match = re.findall(r'/wiki/([^?#]+)', url)
-                    if wiki_match:
-                        title = wiki_match[0].replace('_', ' ')
-
             content = file.read()
-            parsed = wtp.parse(content)
 
-            # remove tags and reparse
-            content = parsed.string
-            for tag in parsed.get_tags():
-                content = content.replace(tag.string, tag.contents)
-            
-            parsed = wtp.parse(content)
-            result = ''
-
-            # processing sections
-            for section in parsed.sections:
-                section_title = section.title
-
-                # skipping unnecessary sections
-                if  section_title:
-                    if section_title.lower() in ['see also', 'references', 'external links', 'further reading', 'notes']:
-                        continue
-                    result += f'\n{section_title}\n'
-
-                section_content : str = section.contents.strip()
-                
-                # handling templates
-                for template in section.templates:
-                    section_content = section_content.replace(template.string, self._handle_template(template))
-
-                # getting link texts
-                for link in section.wikilinks:
-                    if link.text or link.title:
-                        replacement = link.text if link.text else link.title
-                        section_content = section_content.replace(link.string, replacement)
+        title = self._title(os.path.basename(path))
 
-                if not self.keep_external_links:
-                    for link in section.external_links:
-                        if link.text or link.url:
-                            replacement = link.text if link.text else link.url
-                            section_content = section_content.replace(link.string, replacement)
+        if self.legacy:
+            return title, self._rewrite_legacy(content)
 
-                # removing comments
-                for comment in section.comments:
-                    section_content = section_content.replace(comment.string, '')
+        return title, WikiRewriter(self._render_template, self.keep_external_links).rewrite(content)
 
-                # we shouldn't change the tables based on this article:
-                # https://arxiv.org/html/2402.17944v2
+    def _rewrite_legacy(self, content : str) -> str:
+        parsed = wtp.parse(content)
 
-                section_content = section_content.replace("\n===", "\n").replace("===\n", "\n").replace("\n==", "\n").replace("==\n", "\n")
-                result +=  section_content + '\n'
+        # remove tags and reparse
+        content = parsed.string
+        for tag in parsed.get_tags():
+            content = content.replace(tag.string, tag.contents)
+        
+        parsed = wtp.parse(content)
+        result = ''
 
-            return title, result.strip()
+        # processing sections
+        for section in parsed.sections:
+            section_title = section.title
 
-class DbFilter(DataFilter):
-    def _utf8_encode(self, path : str):
-        with open(path, encoding="windows-1250") as file:
-            content = file.read()
+            # skipping unnecessary sections
+            if  section_title:
+                if section_title.lower() in ['see also', 'references', 'external links', 'further reading', 'notes']:
+                    continue
+                result += f'\n{section_title}\n'
+
+            section_content : str = section.contents.strip()
             
-        encoded = content.encode('utf-8')
+            # handling templates
+            for template in section.templates:
+                section_content = section_content.replace(template.string, self._handle_template(template))
+
+            # getting link texts
+            for link in section.wikilinks:
+                if link.text or link.title:
+                    replacement = link.text if link.text else link.title
+                    section_content = section_content.replace(link.string, replacement)
+
+            if not self.keep_external_links:
+                for link in section.external_links:
+                    if link.text or link.url:
+                        replacement = link.text if link.text else link.url
+                        section_content = section_content.replace(link.string, replacement)
 
-        with open(path, 'wb') as file:
-            file.write(encoded)
+            # removing comments
+            for comment in section.comments:
+                section_content = section_content.replace(comment.string, '')
 
+            # we shouldn't change the tables based on this article:
+            # https://arxiv.org/html/2402.17944v2
 
-    def _filter(self, path):
-        soup : BeautifulSoup = None
-        
-        try:
-            with open(path, encoding="utf-8") as file:
-                soup = BeautifulSoup(file, 'html.parser')
-        except UnicodeDecodeError:
-            # change the encoding to utf-8
-            self._utf8_encode(path)
+            section_content = section_content.replace("\n===", "\n").replace("===\n", "\n").replace("\n==", "\n").replace("==\n", "\n")
+            result +=  section_content + '\n'
 
-            with open(path, encoding="utf-8") as file:
-                content = file.read()
+        return result.strip()
 
-            # retry
-            soup = BeautifulSoup(content, 'html.parser')
-        
-        main_content = soup.find('main')
+class DbFilter(DataFilter):
+    # the pdf parts are split by size and named after their pages
+    version = 2
+
+    """
+    max_chars: the size of the pdf parts, workers: the processes extracting the pages of the large pdfs (all cores by default)
+    html_backend: how the pages are parsed (see html_extractor.py)
+    """
+    def __init__(self, max_chars : int = 20000, workers : int = None, html_backend : str = "strainer"):
+        super().__init__()
+        self.max_chars = max_chars
+        self.workers = workers if workers else (os.cpu_count() or 1)
+        self.html_backend = html_backend
+        self.extractor = HtmlExtractor('main', None, html_backend)
+
+        # the pool of the large pdfs while a folder is processed without an executor (see iter_documents)
+        self._pdf_pool : ProcessPoolExecutor = None
+
+    def _filter(self, path):
+        # some pages are windows-1250 encoded, they are decoded without changing the file
+        main_content = self.extractor.find_root(read_html(path, ("utf-8", "windows-1250")))
 
         # finding root of the content
         if not main_content or not main_content.find('h1'):
-            print(path)
+            raise ValueError("no <main> element with a <h1> title")
 
         # gets the first h1 as the title
         title =  main_content.find('h1').text.strip()
@@ -222,39 +404,37 @@ class DbFilter(DataFilter):
 
         return title, "\n".join(text_content)
         
-    def process_folder(self, input_path : str, output_path : str):
-        if not exists(input_path):
-            print(f"{input_path} doesn't exist so it can't be processed")
-            return
-        
-        if not exists(output_path):
-            os.mkdir(output_path)
-        
-        print("Processing pdfs this may take a while")
+    def _cache_params(self, filename):
+        return { "max_chars": self.max_chars, "html_backend": self.html_backend }
 
-        for filename in os.listdir(input_path):
-            if filename == "urls.txt":
-                continue
+    # the pdfs are split here and their pages are extracted on the executor of the filter (if there is one)
+    def _is_streamed(self, filename):
+        return filename.split(".")[-1].lower() == "pdf"
 
-            path = join(input_path, filename)
-            extension = filename.split(".")[-1].lower()
+    def _process_file(self, path, executor = None):
+        filename = os.path.basename(path)
 
-            title : str
-            content : str
+        if not self._is_streamed(filename):
+            return super()._process_file(path)
 
-            if extension == "pdf":
-                # splitting the pdf into parts
-                content = self._get_pdf_content(path)
-                title = filename.capitalize().removesuffix(".pdf")
-                
-                # saving the parts
-                for part, text in enumerate(content, start=1):
-                    with open(join(output_path, f"{title}_{part}"), 'w', encoding="utf8") as file:
-                        file.write(title + "\n" + text)
+        # splitting the pdf into parts, the name of a part has its pages (e.g. Manual_1-12)
+        title = filename.capitalize().removesuffix(".pdf")
+        parts = PdfExtractor(self.max_chars, self.workers, executor=executor if executor else self._pdf_pool).parts(path)
 
-                continue
-            else:
-                title, content = self._filter(path)
-            
-            with open(join(output_path, filename), 'w', encoding="utf8") as file:
-                file.write(title + "\n" + content)
\ No newline at end of file
+        return ((f"{title}_{part.first_page}-{part.last_page}", title, part.text) for part in parts)
+
+    def iter_documents(self, input_path : str, cache : FilterCache = None, executor : Executor = None, output_path : str = None):
+        print("Processing pdfs this may take a while")
+
+        if executor or self.workers <= 1 or multiprocessing.parent_process() is not None:
+            yield from super().iter_documents(input_path, cache, executor, output_path)
+            return
+
+        # the large pdfs of the folder share one pool, its workers are only started when the first one is extracted
+        self._pdf_pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+        try:
+            yield from super().iter_documents(input_path, cache, executor, output_path)
+        finally:
+            self._pdf_pool.shutdown(cancel_futures=True)
+            self._pdf_pool = None
@@ -0,0 +1,53 @@
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+from bs4.builder import builder_registry
+from typing import Optional
+
+"""
+soup:     the whole page is parsed with html.parser (the old filters)
+strainer: html.parser only builds the elements of the content root (same output as soup)
+lxml:     the content root is built by lxml (faster, needs the lxml package, broken html may be parsed differently)
+"""
+BACKENDS = ["soup", "strainer", "lxml"]
+
+# decodes the page with the first encoding which fits (newlines are translated like open() does)
+def decode_html(data : bytes, encodings : tuple[str, ...] = ("utf-8",)) -> str:
+    for encoding in encodings[:-1]:
+        try:
+            text = data.decode(encoding)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        text = data.decode(encodings[-1])
+
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+def read_html(path : str, encodings : tuple[str, ...] = ("utf-8",)) -> str:
+    with open(path, "rb") as file:
+        return decode_html(file.read(), encodings)
+
+class HtmlExtractor:
+    """
+    finds the first element with the given name and attributes (the root of the content) in a page
+    """
+    def __init__(self, name : str, attrs : dict[str, str] = None, backend : str = "strainer"):
+        super().__init__()
+
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown html backend {backend}, use one of {', '.join(BACKENDS)}")
+
+        if backend == "lxml" and builder_registry.lookup("lxml") is None:
+            raise ValueError("The lxml html backend needs the lxml package (pip install lxml)")
+
+        self.name = name
+        self.attrs = attrs if attrs else {}
+        self.backend = backend
+
+    def find_root(self, text : str) -> Optional[Tag]:
+        if self.backend == "soup":
+            soup = BeautifulSoup(text, "html.parser")
+        else:
+            strainer = SoupStrainer(self.name, attrs=self.attrs)
+            soup = BeautifulSoup(text, "html.parser" if self.backend == "strainer" else "lxml", parse_only=strainer)
+
+        return soup.find(self.name, attrs=self.attrs)
@@ -0,0 +1,59 @@
+from typing import Iterable
+from .retriever import Retriever
+from .dense_index import DenseIndex
+from .query_normalizer import QueryNormalizer
+
+class HybridRetriever(Retriever):
+    """
+    fuses the ranking of a lexical retriever (solr or the local index) with the dense index
+    using reciprocal rank fusion: score = sum of 1 / (k + rank) over the rankings containing the document
+    """
+    def __init__(self, lexical : Retriever, dense : DenseIndex, k : int = 60, dense_weight : float = 1.0, normalizer : QueryNormalizer = None):
+        super().__init__()
+        self.lexical = lexical
+        self.dense = dense
+        self.k = k
+        self.dense_weight = dense_weight
+        self.normalizer = normalizer if normalizer else QueryNormalizer.shared()
+
+    def is_available(self) -> bool:
+        return self.lexical.is_available()
+
+    # both indexes get the same (chunked) records, the dense one while they pass to the lexical one
+    def upload_records(self, records : Iterable[dict], chunker = None, **upload_options):
+        if chunker:
+            records = (passage for record in records for passage in chunker.chunk(record))
+
+        def tee(records):
+            for record in records:
+                self.dense.add(record)
+                yield record
+
+        # the dense index is finalized when it is saved
+        self.lexical.upload_records(tee(records), **upload_options)
+
+    def search_documents(self, query : str, language : str, top_n : int = 10, confidence : float = 1.0) -> list[dict]:
+        lexical_docs = self.lexical.search_documents(query, language, top_n, confidence)
+        language = self._route_language(language, confidence)
+        dense_hits = self.dense.search(self.normalizer.normalize(query, language), top_n)
+
+        fused : dict[str, float] = {}
+        docs : dict[str, dict] = {}
+
+        for rank, doc in enumerate(lexical_docs, start=1):
+            fused[doc["id"]] = fused.get(doc["id"], 0.0) + 1.0 / (self.k + rank)
+            docs[doc["id"]] = doc
+
+        for rank, (index, similarity) in enumerate(dense_hits, start=1):
+            record = self.dense.document(index)
+            fused[record["id"]] = fused.get(record["id"], 0.0) + self.dense_weight / (self.k + rank)
+
+            if record["id"] not in docs:
+                docs[record["id"]] = { "id": record["id"], "title": record["title"], "text": record["body"], "url": record.get("url", ""), "score": similarity }
+
+                if "parent_id" in record:
+                    docs[record["id"]]["parent_id"] = record["parent_id"]
+
+        # sorted is stable, so the lexical order decides between equal scores
+        ranking = sorted(fused, key=lambda id: fused[id], reverse=True)[:top_n]
+        return [{ **docs[id], "score": fused[id] } for id in ranking]
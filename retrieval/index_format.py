@@ -0,0 +1,172 @@
+"""
+versioned binary files of the local index, they are opened with mmap so every process shares the same pages
+
+bm25.bin:  header | term offsets (u64) | sorted terms (utf-8) | posting starts (u64) | posting docs (u32) | posting frequencies (u32) | document lengths (u32)
+docs.bin:  header | record offsets (u64) | records (utf-8 json)
+every section starts at an 8 byte aligned position, the numbers are little-endian
+the files of one save share a build id in their headers, so a reader can tell a pair of files from different saves apart
+"""
+import os
+import sys
+import json
+import mmap
+import struct
+from array import array
+from typing import Iterable
+
+FORMAT_VERSION = 2
+
+BM25_MAGIC = b"RAGBM25\0"
+DOCS_MAGIC = b"RAGDOCS\0"
+
+# magic, version, title weight, document count, term count, total length, posting count, build id, 6 section offsets
+BM25_HEADER = struct.Struct("<8sIIIIQQQ6Q")
+# magic, version, record count, build id, offsets section, records section
+DOCS_HEADER = struct.Struct("<8sIIQQQ")
+
+# a random id for the files written by one save
+def new_build_id() -> int:
+    return int.from_bytes(os.urandom(8), "little")
+
+def _padding(position : int) -> bytes:
+    return b"\0" * (-position % 8)
+
+def _little_endian(values : array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+# writes the sections after the header and returns their offsets
+def _write_sections(file, header_size : int, sections : list[bytes]) -> list[int]:
+    offsets = []
+    position = header_size
+
+    file.seek(header_size)
+    file.write(_padding(position))
+    position += len(_padding(position))
+
+    for section in sections:
+        offsets.append(position)
+        file.write(section)
+        position += len(section)
+
+        file.write(_padding(position))
+        position += len(_padding(position))
+
+    return offsets
+
+# writing next to the target and renaming, so the processes which mapped the old file keep reading it
+def _replace(path : str, write):
+    temp_path = path + ".tmp"
+
+    with open(temp_path, "wb") as file:
+        write(file)
+
+    os.replace(temp_path, path)
+
+def write_doc_store(path : str, records : Iterable[dict], build_id : int = 0):
+    offsets = array("Q", [0])
+    blob = bytearray()
+
+    for record in records:
+        blob += json.dumps(record, ensure_ascii=False).encode("utf-8")
+        offsets.append(len(blob))
+
+    def write(file):
+        section_offsets = _write_sections(file, DOCS_HEADER.size, [_little_endian(offsets), bytes(blob)])
+        file.seek(0)
+        file.write(DOCS_HEADER.pack(DOCS_MAGIC, FORMAT_VERSION, len(offsets) - 1, build_id, *section_offsets))
+
+    _replace(path, write)
+
+"""
+postings : term -> (document indexes, frequencies), lengths : the length of every document
+"""
+def write_bm25(path : str, postings : dict[str, tuple[array, array]], lengths : array, title_weight : int, build_id : int = 0):
+    terms = sorted(postings, key=lambda term: term.encode("utf-8"))
+
+    term_offsets = array("Q", [0])
+    term_blob = bytearray()
+    posting_starts = array("Q", [0])
+    posting_docs = array("I")
+    posting_frequencies = array("I")
+
+    for term in terms:
+        term_blob += term.encode("utf-8")
+        term_offsets.append(len(term_blob))
+
+        docs, frequencies = postings[term]
+        posting_docs.extend(docs)
+        posting_frequencies.extend(frequencies)
+        posting_starts.append(len(posting_docs))
+
+    sections = [
+        _little_endian(term_offsets),
+        bytes(term_blob),
+        _little_endian(posting_starts),
+        _little_endian(posting_docs),
+        _little_endian(posting_frequencies),
+        _little_endian(array("I", lengths))
+    ]
+
+    def write(file):
+        offsets = _write_sections(file, BM25_HEADER.size, sections)
+        file.seek(0)
+        file.write(BM25_HEADER.pack(BM25_MAGIC, FORMAT_VERSION, title_weight, len(lengths), len(terms), sum(lengths), len(posting_docs), build_id, *offsets))
+
+    _replace(path, write)
+
+class MappedFile:
+    """
+    read-only memory map of an index file with typed views of its sections
+    """
+    def __init__(self, path : str, magic : bytes, header : struct.Struct):
+        super().__init__()
+        self.path = path
+
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.view = memoryview(self.map)
+        self.header = header.unpack_from(self.map, 0)
+
+        if self.header[0] != magic:
+            raise ValueError(f"{path} is not a {magic.rstrip(bytes(1)).decode()} file")
+
+        if self.header[1] != FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {self.header[1]}, expected {FORMAT_VERSION}. Rebuild the index")
+
+    # a view of count numbers (typecode 'I' or 'Q') starting at offset, copied only on big-endian machines
+    def numbers(self, typecode : str, offset : int, count : int):
+        size = array(typecode).itemsize
+        view = self.view[offset:offset + count * size]
+
+        if sys.byteorder == "little":
+            return view.cast(typecode)
+
+        values = array(typecode, bytes(view))
+        values.byteswap()
+        return values
+
+    def bytes_at(self, start : int, end : int) -> memoryview:
+        return self.view[start:end]
+
+class DocStore:
+    """
+    offset addressed document records, only the requested records are decoded
+    """
+    def __init__(self, path : str):
+        super().__init__()
+        self.file = MappedFile(path, DOCS_MAGIC, DOCS_HEADER)
+        _, _, self.count, self.build_id, offsets_start, self.blob_start = self.file.header
+
+        self.offsets = self.file.numbers("Q", offsets_start, self.count + 1)
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index : int) -> dict:
+        start = self.blob_start + self.offsets[index]
+        end = self.blob_start + self.offsets[index + 1]
+        return json.loads(bytes(self.file.bytes_at(start, end)).decode("utf-8"))
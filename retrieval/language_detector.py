@@ -0,0 +1,79 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+from langdetect import DetectorFactory, PROFILES_DIRECTORY
+from langdetect.lang_detect_exception import LangDetectException
+
+class Detection(NamedTuple):
+    language : str
+    confidence : float
+
+class LanguageDetector:
+    """
+    language identification limited to the indexed languages
+    the profiles are loaded once, the detection is seeded (the same text always gets the same language)
+    and the results of the recent queries are kept
+    """
+    _shared : "LanguageDetector" = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, languages : tuple[str, ...] = ('en', 'de', 'hu'), default : str = 'en', max_chars : int = 500, cache_size : int = 1024, seed : int = 0):
+        super().__init__()
+        self.languages = languages
+        self.default = default
+        self.max_chars = max_chars
+        self.cache_size = cache_size
+
+        # a private factory, so the global one of langdetect (with every profile) is never built
+        self._factory = DetectorFactory()
+        self._factory.seed = seed
+        self._factory.load_json_profile([self._read_profile(language) for language in languages])
+
+        self._cache : OrderedDict[str, Detection] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read_profile(language : str) -> str:
+        with open(os.path.join(PROFILES_DIRECTORY, language), 'r', encoding='utf-8') as file:
+            return file.read()
+
+    # one instance shared by the clients of the process
+    @classmethod
+    def shared(cls) -> "LanguageDetector":
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def detect(self, text : str) -> Detection:
+        # only the beginning is used, so long inputs cost the same as short ones
+        text = text.strip()[:self.max_chars]
+
+        with self._lock:
+            if text in self._cache:
+                self._cache.move_to_end(text)
+                return self._cache[text]
+
+        detection = self._detect(text)
+
+        with self._lock:
+            self._cache[text] = detection
+
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return detection
+
+    def _detect(self, text : str) -> Detection:
+        detector = self._factory.create()
+        detector.set_max_text_length(self.max_chars)
+        detector.append(text)
+
+        try:
+            best = detector.get_probabilities()[0]
+        except (LangDetectException, IndexError):
+            # no letters in the text
+            return Detection(self.default, 0.0)
+
+        return Detection(best.lang, best.prob)
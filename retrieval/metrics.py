@@ -0,0 +1,204 @@
+import os
+import json
+import time
+import threading
+from typing import TextIO
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class _NullSpan:
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+# returned by every span while the metrics are off, so nothing is allocated or timed
+NULL_SPAN = _NullSpan()
+
+class _Span:
+    __slots__ = ["metrics", "name", "labels", "start"]
+
+    def __init__(self, metrics : "Metrics", name : str, labels : dict[str, str]):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.metrics.observe(f"{self.name}_seconds", time.perf_counter() - self.start, **self.labels)
+        return False
+
+class Metrics:
+    """
+    timing spans and measurements of the pipeline and the chat, off by default
+    every metric is summarized by its count, sum and maximum (per label values) and can be exported as prometheus text,
+    the single measurements can also be written to a jsonl file
+    while the metrics are off spans and observations return right away
+    """
+    _shared : "Metrics" = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, prefix : str = "rag"):
+        super().__init__()
+        self.prefix = prefix
+        self.enabled = False
+
+        # (name, labels) -> [count, sum, max]
+        self._summaries : dict[tuple[str, tuple[tuple[str, str], ...]], list[float]] = {}
+        self._lock = threading.Lock()
+        self._sink : TextIO = None
+        self._server : ThreadingHTTPServer = None
+
+    # one instance shared by the whole process
+    @classmethod
+    def shared(cls) -> "Metrics":
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    # jsonl_path: the file the measurements are appended to (optional)
+    def enable(self, jsonl_path : str = None):
+        with self._lock:
+            if jsonl_path and self._sink is None:
+                self._sink = open(jsonl_path, "a", encoding="utf-8")
+
+            self.enabled = True
+
+    def disable(self):
+        with self._lock:
+            self.enabled = False
+
+            if self._sink:
+                self._sink.close()
+                self._sink = None
+
+    """
+    turns on the metrics based on the environment (after the .env file is loaded):
+    METRICS=true, METRICS_JSONL=<file> for the measurements, METRICS_PORT=<port> for the prometheus endpoint (if serve is set)
+    """
+    def enable_from_env(self, serve : bool = True):
+        jsonl_path = os.environ.get("METRICS_JSONL")
+        port = os.environ.get("METRICS_PORT")
+
+        if os.environ.get("METRICS", "").lower() in ["1", "true", "yes"] or jsonl_path or port:
+            self.enable(jsonl_path)
+
+        if port and serve:
+            try:
+                self.serve(int(port))
+            except OSError as error:
+                print(f"Couldn't serve the metrics on port {port}: {error}")
+
+    # times the block as <name>_seconds, e.g. with metrics.span("solr_request", core="docs"):
+    def span(self, name : str, **labels):
+        if not self.enabled:
+            return NULL_SPAN
+
+        return _Span(self, name, labels)
+
+    def observe(self, name : str, value : float, **labels):
+        if not self.enabled:
+            return
+
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+
+        with self._lock:
+            summary = self._summaries.get(key)
+
+            if summary is None:
+                self._summaries[key] = [1, value, value]
+            else:
+                summary[0] += 1
+                summary[1] += value
+                summary[2] = max(summary[2], value)
+
+            if self._sink:
+                self._sink.write(json.dumps({ "time": time.time(), "metric": name, "value": value, **labels }) + "\n")
+                self._sink.flush()
+
+    def reset(self):
+        with self._lock:
+            self._summaries.clear()
+
+    # the summaries as { name: [ { labels, count, sum, max } ] }
+    def snapshot(self) -> dict[str, list[dict]]:
+        with self._lock:
+            items = [(key, list(summary)) for key, summary in self._summaries.items()]
+
+        result : dict[str, list[dict]] = {}
+
+        for (name, labels), (count, total, maximum) in sorted(items):
+            result.setdefault(name, []).append({ "labels": dict(labels), "count": count, "sum": total, "max": maximum })
+
+        return result
+
+    @staticmethod
+    def _labels(labels : dict[str, str]) -> str:
+        if not labels:
+            return ""
+
+        escaped = [(label, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for label, value in labels.items()]
+        return "{" + ",".join(f'{label}="{value}"' for label, value in escaped) + "}"
+
+    # the summaries in the prometheus text format (a summary without quantiles and a gauge of the maximum)
+    def to_prometheus(self) -> str:
+        lines = []
+
+        for name, series in self.snapshot().items():
+            metric = f"{self.prefix}_{name}"
+            lines.append(f"# TYPE {metric} summary")
+
+            for item in series:
+                lines.append(f"{metric}_count{self._labels(item['labels'])} {item['count']}")
+                lines.append(f"{metric}_sum{self._labels(item['labels'])} {item['sum']:.6f}")
+
+            lines.append(f"# TYPE {metric}_max gauge")
+
+            for item in series:
+                lines.append(f"{metric}_max{self._labels(item['labels'])} {item['max']:.6f}")
+
+        return "\n".join(lines) + "\n"
+
+    # a short table of the summaries, e.g. at the end of a pipeline run
+    def report(self) -> str:
+        lines = []
+
+        for name, series in self.snapshot().items():
+            for item in series:
+                labels = ",".join(f"{label}={value}" for label, value in item["labels"].items())
+                lines.append(f"{name:<36} {labels:<32} n={item['count']:<6} mean={item['sum'] / item['count']:.4f} max={item['max']:.4f}")
+
+        return "\n".join(lines)
+
+    # serves the prometheus text on http://<host>:<port>/metrics from a background thread
+    def serve(self, port : int, host : str = "0.0.0.0") -> ThreadingHTTPServer:
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = metrics.to_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        with self._lock:
+            if self._server is None:
+                self._server = ThreadingHTTPServer((host, port), Handler)
+                threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+            return self._server
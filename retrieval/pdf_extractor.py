@@ -0,0 +1,100 @@
+import os
+import multiprocessing
+from collections import deque
+from itertools import islice
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pypdf import PdfReader
+from typing import NamedTuple, Generator
+
+class PdfPart(NamedTuple):
+    # page numbers start at 1, the last page is included
+    first_page : int
+    last_page : int
+    text : str
+
+# extracts a range of pages (module level function, so it can be sent to worker processes)
+def _extract_pages(path : str, start : int, end : int) -> list[str]:
+    reader = PdfReader(path)
+    return [reader.pages[index].extract_text() for index in range(start, end)]
+
+class PdfExtractor:
+    """
+    extracts the text of a pdf in page ranges on worker processes and groups the pages into parts of about max_chars characters
+    the parts are yielded as soon as they fill, only max_in_flight page ranges are extracted at the same time,
+    so the memory use doesn't depend on the size of the pdf
+    a part is never split inside a page, a single page longer than max_chars is a part on its own
+    only pdfs with at least min_pool_pages pages are extracted in parallel, the start of the worker processes costs more than the smaller ones take
+    with an executor (e.g. the pool of the filters) the pages are extracted by its workers, otherwise a pool is started for the pdf,
+    its workers are spawned (forking a process with running threads, e.g. the uploads of the pipeline, can deadlock)
+    """
+    def __init__(self, max_chars : int = 20000, workers : int = None, pages_per_task : int = 8, max_in_flight : int = None, executor : Executor = None, min_pool_pages : int = 100):
+        super().__init__()
+        self.max_chars = max_chars
+        self.workers = workers if workers else (os.cpu_count() or 1)
+        self.pages_per_task = pages_per_task
+        self.max_in_flight = max_in_flight if max_in_flight else self.workers * 2
+        self.executor = executor
+        self.min_pool_pages = min_pool_pages
+
+    # yields the texts of the pages in order, one page range at a time
+    def _page_batches(self, path : str) -> Generator[list[str], None, None]:
+        reader = PdfReader(path)
+        page_count = len(reader.pages)
+        ranges = [(start, min(start + self.pages_per_task, page_count)) for start in range(0, page_count, self.pages_per_task)]
+
+        # small pdfs aren't worth the work of the processes, inside the worker processes of the filters the pools aren't nested
+        small = page_count < self.min_pool_pages or len(ranges) <= 1
+
+        if small or multiprocessing.parent_process() is not None or (self.executor is None and self.workers <= 1):
+            for start, end in ranges:
+                yield [reader.pages[index].extract_text() for index in range(start, end)]
+            return
+
+        if self.executor is not None:
+            del reader
+            yield from self._extract_on(self.executor, path, ranges)
+            return
+
+        del reader
+
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(ranges)), mp_context=multiprocessing.get_context("spawn")) as pool:
+            yield from self._extract_on(pool, path, ranges)
+
+    # only max_in_flight page ranges are submitted at once, the results are yielded in order
+    def _extract_on(self, executor : Executor, path : str, ranges : list[tuple[int, int]]) -> Generator[list[str], None, None]:
+        remaining = iter(ranges)
+        pending = deque(executor.submit(_extract_pages, path, start, end) for start, end in islice(remaining, self.max_in_flight))
+
+        try:
+            while pending:
+                pages = pending.popleft().result()
+
+                for start, end in islice(remaining, 1):
+                    pending.append(executor.submit(_extract_pages, path, start, end))
+
+                yield pages
+        finally:
+            # an abandoned pdf doesn't leave its pages on a shared executor
+            for future in pending:
+                future.cancel()
+
+    def parts(self, path : str) -> Generator[PdfPart, None, None]:
+        pages : list[str] = []
+        size = 0
+        first_page = 1
+        page_number = 0
+
+        for batch in self._page_batches(path):
+            for text in batch:
+                page_number += 1
+                text = f"\n{text}"
+
+                if pages and size + len(text) > self.max_chars:
+                    yield PdfPart(first_page, page_number - 1, "".join(pages))
+                    pages, size, first_page = [], 0, page_number
+
+                pages.append(text)
+                size += len(text)
+
+        if pages:
+            yield PdfPart(first_page, page_number, "".join(pages))
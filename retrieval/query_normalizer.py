@@ -0,0 +1,86 @@
+import os
+import re
+import time
+import threading
+from os.path import join
+
+class QueryNormalizer:
+    """
+    lower-cases the queries, removes the punctuation and the stopwords of the language
+    the stopword files are loaded once per process and reloaded only if they change on the disk
+    """
+    PUNCTUATION = re.compile(r'[^\w\s]')
+
+    _shared : "QueryNormalizer" = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, stopwords_dir : str = None, check_interval : float = 5.0):
+        super().__init__()
+
+        if stopwords_dir is None:
+            stopwords_dir = join(os.path.dirname(__file__), 'volume', 'data', 'ragcore', 'conf', 'lang')
+
+        self.stopwords_dir = stopwords_dir
+        self.check_interval = check_interval
+
+        # language -> (mtime, last check, stopwords)
+        self._stopwords : dict[str, tuple[float, float, frozenset[str]]] = {}
+        self._lock = threading.Lock()
+
+    # one instance shared by every SolrHandler of the process
+    @classmethod
+    def shared(cls) -> "QueryNormalizer":
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls()
+            return cls._shared
+
+    def stopwords(self, language : str) -> frozenset[str]:
+        now = time.monotonic()
+        cached = self._stopwords.get(language)
+
+        # the file is only checked every few seconds
+        if cached and now - cached[1] < self.check_interval:
+            return cached[2]
+
+        path = join(self.stopwords_dir, f'stopwords_{language}.txt')
+
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            print(f"Missing stopwords for '{language}'")
+            mtime = -1.0
+
+        with self._lock:
+            cached = self._stopwords.get(language)
+
+            if cached and cached[0] == mtime:
+                words = cached[2]
+            elif mtime < 0:
+                words = frozenset()
+            else:
+                words = self._load(path)
+
+            self._stopwords[language] = (mtime, now, words)
+            return words
+
+    """
+    reads a stopword file with one word per line like the StopFilter of solr, the text after '#' is a comment
+    the snowball format (comments after '|') is also supported
+    """
+    def _load(self, path : str) -> frozenset[str]:
+        words = set()
+
+        with open(path, 'r', encoding='utf-8') as file:
+            for line in file:
+                tokens = line.split('|', 1)[0].split('#', 1)[0].split()
+
+                if tokens:
+                    words.add(tokens[0])
+
+        return frozenset(words)
+
+    def normalize(self, query : str, language : str) -> str:
+        stopwords = self.stopwords(language)
+        clear_query = self.PUNCTUATION.sub(' ', query.lower())
+        return " ".join([word for word in clear_query.split() if word not in stopwords])
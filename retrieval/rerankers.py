@@ -0,0 +1,96 @@
+import re
+import math
+from collections import Counter
+
+class Reranker:
+    """
+    re-orders the documents returned by the search engine
+    rank gets the normalized query and the texts in the order of the engine and returns a score for each text
+    """
+    TOKEN = re.compile(r'\w+')
+
+    def __init__(self, max_chars : int = 20000):
+        super().__init__()
+        # only the beginning of long documents is scored, so the time doesn't depend on the document length
+        self.max_chars = max_chars
+
+    def _tokens(self, text : str) -> list[str]:
+        return self.TOKEN.findall(text[:self.max_chars].lower())
+
+    # the original order of the engine as a prior (500, 450, 400, ...)
+    @staticmethod
+    def _prior(index : int) -> float:
+        return 500 - (index + 1) * 50
+
+    def rank(self, clear_query : str, texts : list[str]) -> list[float]:
+        return [self._prior(index) for index in range(len(texts))]
+
+class SubstringReranker(Reranker):
+    """
+    the original heuristic: +1 for every word of the document which is a substring of the query
+    (it also matches partial words like 'a' in 'data', kept for comparison)
+    """
+    def rank(self, clear_query, texts):
+        scores = []
+
+        for index, text in enumerate(texts):
+            score = self._prior(index)
+
+            for word in self._tokens(text):
+                if word in clear_query:
+                    score += 1
+
+            scores.append(score)
+        return scores
+
+class TokenOverlapReranker(Reranker):
+    """
+    +1 for every word of the document which is a whole word of the query
+    """
+    def rank(self, clear_query, texts):
+        query_terms = set(clear_query.split())
+        scores = []
+
+        for index, text in enumerate(texts):
+            counts = Counter(self._tokens(text))
+            scores.append(self._prior(index) + sum(counts[term] for term in query_terms))
+
+        return scores
+
+class BM25Reranker(Reranker):
+    """
+    BM25 scores computed over the returned documents, the engine's order only breaks the ties
+    """
+    def __init__(self, max_chars : int = 20000, k1 : float = 1.2, b : float = 0.75):
+        super().__init__(max_chars)
+        self.k1 = k1
+        self.b = b
+
+    def rank(self, clear_query, texts):
+        query_terms = set(clear_query.split())
+        counts = [Counter(self._tokens(text)) for text in texts]
+        lengths = [sum(count.values()) for count in counts]
+
+        if not texts:
+            return []
+
+        average_length = max(sum(lengths) / len(lengths), 1)
+        scores = []
+
+        for index, (count, length) in enumerate(zip(counts, lengths)):
+            score = 0.0
+
+            for term in query_terms:
+                frequency = count[term]
+
+                if frequency == 0:
+                    continue
+
+                document_frequency = sum(1 for other in counts if term in other)
+                idf = math.log(1 + (len(texts) - document_frequency + 0.5) / (document_frequency + 0.5))
+                score += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * (1 - self.b + self.b * length / average_length))
+
+            # the prior is small enough to only decide between equal scores
+            scores.append(score + self._prior(index) * 1e-6)
+
+        return scores
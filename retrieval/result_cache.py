@@ -0,0 +1,79 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+class ResultCache:
+    """
+    thread-safe LRU cache with a time to live for the search results
+    it also counts the hits, misses and evictions and estimates the time saved by the hits
+    """
+    def __init__(self, max_entries : int = 1024, ttl : float = 600):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # key -> (expiry time, value)
+        self._entries : OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._miss_seconds = 0.0
+        self._timed_misses = 0
+
+    def get(self, key : Hashable) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    # stores a value, the duration of the lookup is used to estimate the saved time
+    def put(self, key : Hashable, value : Any, duration : float = None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+            if duration is not None:
+                self._miss_seconds += duration
+                self._timed_misses += 1
+
+    # drops every entry (e.g. after new documents were indexed)
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            average_miss = self._miss_seconds / self._timed_misses if self._timed_misses else 0.0
+
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "average_miss_seconds": average_miss,
+                "saved_seconds": self.hits * average_miss
+            }
@@ -0,0 +1,53 @@
+from typing import Tuple, Iterable
+
+class Retriever:
+    """
+    common interface of the retrieval engines (solr, local index, ...) used by the LLM clients
+    the found documents are dicts with 'id', 'title', 'text', 'url' and 'score' keys (passages also have 'parent_id')
+    confidence is the certainty of the detected language, below min_language_confidence the english field is searched
+    """
+    min_language_confidence : float = 0.5
+
+    def is_available(self) -> bool:
+        return True
+
+    # indexes document records (see documents.py), with a chunker as overlapping passages
+    def upload_records(self, records : Iterable[dict], chunker = None, **upload_options):
+        pass
+
+    # returns the found documents, the best one first
+    def search_documents(self, query : str, language : str, top_n : int = 10, confidence : float = 1.0) -> list[dict]:
+        return []
+
+    # returns the texts and the sources for the prompt
+    def search(self, query : str, language : str, top_n : int = 10, confidence : float = 1.0) -> Tuple[list[str], list[str]]:
+        docs = self.search_documents(query, language, top_n, confidence)
+
+        if len(docs) == 0:
+            return [], []
+
+        #! right now it's just a single result, but it could return multiple documents
+        return self._format_result(docs[0])
+
+    # an uncertain detection is not worth a round trip to the field of that language
+    def _route_language(self, language : str, confidence : float) -> str:
+        return language if confidence >= self.min_language_confidence else "en"
+
+    @staticmethod
+    def _format_result(doc : dict) -> Tuple[list[str], list[str]]:
+        full_text = doc['text']
+        sources = [doc['url']] if doc.get('url') is not None else []
+
+        # passages are already small enough
+        if 'parent_id' in doc:
+            return [doc['title'] + "\n" + full_text], sources
+
+        # Limit text to first 500 characters to avoid context overflow
+        # Take first 500 chars and try to end at a sentence
+        limited_text = full_text[:500]
+        last_period = limited_text.rfind('.')
+        if last_period > 100:  # If there's a sentence ending, use it
+            limited_text = limited_text[:last_period + 1]
+        limited_text += ("..." if len(full_text) > len(limited_text) else "")
+
+        return [doc['title'] + "\n" + limited_text], sources
@@ -1,16 +1,55 @@
-import os
 import re
-from os.path import exists, join
-from pysolr import Solr, SolrError, Results
-from typing import Tuple
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from os.path import exists
+from pysolr import Solr, SolrError
+from typing import Tuple, Iterable, Generator, Optional
+from .documents import read_folder, PDF_PAGES
+from .query_normalizer import QueryNormalizer
+from .result_cache import ResultCache
+from .rerankers import Reranker, TokenOverlapReranker
+from .chunker import PassageChunker
+from .retriever import Retriever
+from .metrics import Metrics
 
-class SolrHandler:
-    def __init__(self, host : str, core : str, min_score_weight : float = 1):
+metrics = Metrics.shared()
+
+"""
+how the english documents are searched when a query in another language finds nothing:
+sequential: a second request after the native one (two round trips on a miss)
+parallel:   the english request is sent together with the native one (one round trip, an extra request for every non english query)
+combined:   a single request over the native and the english text, the english matches are scored with english_weight
+"""
+LANGUAGE_FALLBACKS = ["sequential", "parallel", "combined"]
+
+class SolrHandler(Retriever):
+    """
+    snippets: the number of highlighted fragments (of about fragment_size characters) returned as the text of a document,
+    the bodies stay on the server, 0 returns the whole texts
+    """
+    def __init__(self, host : str, core : str, min_score_weight : float = 1, normalizer : QueryNormalizer = None, cache_size : int = 1024, cache_ttl : float = 600, reranker : Reranker = None, language_fallback : str = "parallel", english_weight : float = 0.5, snippets : int = 0, fragment_size : int = 250):
         super().__init__()
+
+        if language_fallback not in LANGUAGE_FALLBACKS:
+            raise ValueError(f"Unknown language fallback {language_fallback}, use one of {', '.join(LANGUAGE_FALLBACKS)}")
+
         self.host = host
         self.core = core
         self.solr = Solr(self._get_url(), timeout=410)
         self.min_score_weight = min_score_weight
+        self.normalizer = normalizer if normalizer else QueryNormalizer.shared()
+        self.reranker = reranker if reranker else TokenOverlapReranker()
+
+        # cache_size = 0 turns off the result cache
+        self.cache = ResultCache(cache_size, cache_ttl) if cache_size > 0 else None
+
+        self.language_fallback = language_fallback
+        self.english_weight = english_weight
+        self._fallback_pool = ThreadPoolExecutor(max_workers=8) if language_fallback == "parallel" else None
+
+        self.snippets = snippets
+        self.fragment_size = fragment_size
 
     def _get_url(self, core : str = '') -> str:
         return f"http://{self.host}/solr/{core if core != '' else self.core}"
@@ -30,113 +69,296 @@ class SolrHandler:
             print(error)
         return False
     
-    def upload_forlder(self, folder : str, url_for_data : dict[str, str]):
+    # converts a document record to the fields of the solr schema
+    def _to_solr_doc(self, record : dict) -> dict:
+        # Store in language-specific field for proper text analysis
+        doc = {
+            "id": record["id"],
+            "title": record["title"],
+            "text_en": record["body"],  # Default to English
+            "url": record["url"]
+        }
+
+        # passages know their document and their position in it
+        for field in ["parent_id", "offset_start", "offset_end"]:
+            if field in record:
+                doc[field] = record[field]
+
+        return doc
+
+    @staticmethod
+    def _quote(value : str) -> str:
+        return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    # the name of the pdf a part (or a passage of a part) belongs to, e.g. Manual for Manual_1-12#3, None for other documents
+    @staticmethod
+    def _pdf_name(doc : dict) -> Optional[str]:
+        name, _, part = doc.get('parent_id', doc['id']).rpartition('_')
+        return name if name and PDF_PAGES.fullmatch(part) else None
+
+    """
+    removes every part of a pdf before its new parts are indexed, the parts are cut by size and named after their pages,
+    so a changed pdf (or max_chars) gives new ids, the numbered parts of the older versions (e.g. Manual_3) are removed as well
+    """
+    def _delete_pdf_parts(self, name : str, max_retries : int):
+        # a lucene regular expression on the ids (# and the spaces have to be escaped as well)
+        pattern = re.sub(r'([.?+*|{}\[\]()"\\#@&<>~/ ])', r'\\\1', name) + r"_[0-9]+(-[0-9]+)?(\#[0-9]+)?"
+
+        for attempt in range(max_retries + 1):
+            try:
+                with metrics.span("solr_update"):
+                    self.solr.delete(q=f"id:/{pattern}/", commit=False)
+                return
+            except SolrError as error:
+                print(f"Couldn't remove the old parts of {name} ({attempt + 1}/{max_retries + 1}): {error}")
+
+                if attempt < max_retries:
+                    time.sleep(2 ** attempt)
+
+    @staticmethod
+    def _doc_size(doc : dict) -> int:
+        return sum(len(value.encode('utf-8')) for value in doc.values() if isinstance(value, str))
+
+    # groups the documents into batches limited by document count and size
+    def _batches(self, docs : Iterable[dict], max_docs : int, max_bytes : int) -> Generator[Tuple[list[dict], int], None, None]:
+        batch : list[dict] = []
+        batch_bytes = 0
+
+        for doc in docs:
+            size = self._doc_size(doc)
+
+            # the passages of a document stay in the same batch (see _add_batch)
+            same_parent = 'parent_id' in doc and batch and batch[-1].get('parent_id') == doc['parent_id']
+
+            if batch and not same_parent and (len(batch) >= max_docs or batch_bytes + size > max_bytes):
+                yield batch, batch_bytes
+                batch, batch_bytes = [], 0
+
+            batch.append(doc)
+            batch_bytes += size
+
+        if batch:
+            yield batch, batch_bytes
+
+    # sends a single batch, only this batch is retried if it fails
+    def _add_batch(self, batch : list[dict], commit_within : int, max_retries : int) -> bool:
+        parents = sorted({doc['parent_id'] for doc in batch if 'parent_id' in doc})
+
+        for attempt in range(max_retries + 1):
+            try:
+                with metrics.span("solr_update"):
+                    # removing the whole documents and the outdated passages of the re-chunked documents
+                    if parents:
+                        quoted = " OR ".join(self._quote(parent) for parent in parents)
+                        self.solr.delete(q=f"parent_id:({quoted})", commit=False)
+                        self.solr.delete(id=parents, commit=False)
+
+                    self.solr.add(batch, commit=False, commitWithin=commit_within)
+                return True
+            except SolrError as error:
+                print(f"Batch of {len(batch)} documents failed ({attempt + 1}/{max_retries + 1}): {error}")
+
+                if attempt < max_retries:
+                    time.sleep(2 ** attempt)
+        return False
+
+    """
+    streams the documents to solr in size bounded batches with a few batches in flight at once
+    the documents become visible through commitWithin and a soft commit at the end
+    """
+    def upload_docs(self, docs : Iterable[dict], batch_docs : int = 500, batch_bytes : int = 8 * 1024 * 1024, max_in_flight : int = 4, commit_within : int = 10000, max_retries : int = 3):
+        start = time.perf_counter()
+        sent_docs = sent_bytes = failed_docs = 0
+        in_flight : deque[Tuple[Future, int, int]] = deque()
+        pdfs : set[str] = set()
+
+        def collect(future : Future, count : int, size : int):
+            nonlocal sent_docs, sent_bytes, failed_docs
+
+            if future.result():
+                sent_docs += count
+                sent_bytes += size
+            else:
+                failed_docs += count
+
+        with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+            for batch, size in self._batches(docs, batch_docs, batch_bytes):
+                # the old parts of a pdf are removed once, before the first batch with its new parts is sent
+                for name in sorted({self._pdf_name(doc) for doc in batch} - pdfs - {None}):
+                    self._delete_pdf_parts(name, max_retries)
+                    pdfs.add(name)
+
+                # waiting for the oldest batch keeps the memory bounded
+                if len(in_flight) >= max_in_flight:
+                    collect(*in_flight.popleft())
+
+                in_flight.append((executor.submit(self._add_batch, batch, commit_within, max_retries), len(batch), size))
+
+            while in_flight:
+                collect(*in_flight.popleft())
+
+        if sent_docs > 0:
+            try:
+                self.solr.commit(softCommit=True)
+            except SolrError as error:
+                print(f"Soft commit failed, documents become visible after {commit_within} ms: {error}")
+
+            # the cached results may be outdated now
+            if self.cache:
+                self.cache.invalidate()
+
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        print(f"Indexed {sent_docs} documents ({sent_bytes / 1e6:.2f} MB) in {elapsed:.1f}s: {sent_docs / elapsed:.1f} docs/s, {sent_bytes / 1e6 / elapsed:.2f} MB/s" + (f", {failed_docs} failed" if failed_docs else ""))
+
+    # indexes document records (see documents.py), e.g. straight from the filters
+    # with a chunker every document is indexed as overlapping passages
+    def upload_records(self, records : Iterable[dict], chunker : PassageChunker = None, **upload_options):
+        if chunker:
+            records = (passage for record in records for passage in chunker.chunk(record))
+
+        self.upload_docs((self._to_solr_doc(record) for record in records), **upload_options)
+
+    def upload_forlder(self, folder : str, url_for_data : dict[str, str], chunker : PassageChunker = None):
         if not exists(folder):
             print(f"{folder} doesn't exist")
             return
 
-        docs : list[dict] = []
-
-        for filename in os.listdir(folder):
-            if filename == "urls.txt":
-                continue
-
-            with open(join(folder, filename), 'r', encoding='utf-8') as file:
-                content = file.read()
-
-                url = url_for_data[filename] if filename in url_for_data else ""
-
-                # handling split pdfs
-                if url == "":
-                    backup = '_'.join(filename.split('_')[:-1]).lower() + ".pdf"
-                    url = url_for_data[backup] if backup in url_for_data else ""
-                
-                # Store in language-specific field for proper text analysis
-                docs.append({
-                    "id": filename,
-                    "title": content.splitlines()[0],
-                    "text_en": "\n".join(content.splitlines()[1:]),  # Default to English
-                    "url": url
-                })
-
-        self.solr.add(docs)
-
-    def search(self, query : str, language : str, top_n : int = 10) -> Tuple[list[str], list[str]]:
-        with open(os.path.join(os.path.dirname(__file__), f'./volume/data/ragcore/conf/lang/stopwords_{language}.txt'), 'r', encoding='utf-8') as file:
-            stopwords = file.read().splitlines()
-        
-        clear_query = re.sub(r'[^\w\s]', ' ', query.lower())
-        clear_query = " ".join([word for word in clear_query.split() if word not in stopwords])
-        text_field = f"text_{language}"
+        self.upload_records(read_folder(folder, url_for_data), chunker)
+
+    def search(self, query : str, language : str, top_n : int = 10, confidence : float = 1.0) -> Tuple[list[str], list[str]]:
+        language = self._route_language(language, confidence)
+        clear_query = self.normalizer.normalize(query, language)
+        key = (clear_query, language, top_n)
+
+        if self.cache:
+            cached = self.cache.get(key)
+
+            if cached is not None:
+                return list(cached[0]), list(cached[1])
+
+        start = time.perf_counter()
+        docs = self._search(clear_query, language, top_n)
+        texts, sources = self._format_result(docs[0]) if docs else ([], [])
+
+        if self.cache:
+            self.cache.put(key, (tuple(texts), tuple(sources)), time.perf_counter() - start)
+
+        return texts, sources
+
+    def search_documents(self, query : str, language : str, top_n : int = 10, confidence : float = 1.0) -> list[dict]:
+        language = self._route_language(language, confidence)
+        return self._search(self.normalizer.normalize(query, language), language, top_n)
+
+    """
+    searches with an already normalized query and returns the re-ranked documents
+    when nothing is found in the language of the query the english documents are used (see language_fallback)
+    """
+    def _search(self, clear_query : str, language : str, top_n : int) -> list[dict]:
+        if language == "en" or self.language_fallback == "sequential":
+            docs = self._request(clear_query, language, top_n)
+
+            # if no results found, try to search in english
+            if len(docs) == 0 and language != "en":
+                #* translation could be done here
+                return self._search(self.normalizer.normalize(clear_query, "en"), "en", top_n)
+
+            return self._rank(clear_query, language, docs)
 
-        #* a well setup highlighter could also do the job
-        # "hl":"true",
-        # "hl.tag.pre":"**",
-        # "hl.tag.post":"**",
-        # "hl.method":"unified",
-        # "hl.usePhraseHighLighter":"false",
-        # "hl.highlightMultiTerm":"false",
-        # "hl.fragsize": str(frag_size),
+        if self.language_fallback == "combined":
+            return self._rank(clear_query, language, self._request(clear_query, language, top_n, with_english=True))
+
+        # the english request runs while the native one is waited for, its results are only used if the native one finds nothing
+        english_query = self.normalizer.normalize(clear_query, "en")
+        english = self._fallback_pool.submit(self._request, english_query, "en", top_n)
+        docs = self._request(clear_query, language, top_n)
+
+        if len(docs) > 0:
+            return self._rank(clear_query, language, docs)
+
+        return self._rank(english_query, "en", english.result())
+
+    # returns the solr documents above the score threshold, with_english also searches the english text (with english_weight)
+    def _request(self, clear_query : str, language : str, top_n : int, with_english : bool = False) -> list[dict]:
+        text_field = f"text_{language}"
+        query_fields = f"title^2 {text_field} text_en^{self.english_weight} url" if with_english else f"title^2 {text_field} url"
 
         params = {
-            "fl":       "score,title,text_en,url,"+text_field,
+            "fl":       "id,score,title,text_en,url,parent_id,"+text_field,
             "sort":     "score desc",
             "rows":     str(top_n),
             "tie":      "0.1",
             "defType":  "edismax",
-            "qf":       f"title^2 {text_field} url",
+            "qf":       query_fields,
             "pf":       f"{text_field}^2",
             "stopwords":"true",
         }
 
-        results = self.solr.search(clear_query,**params)
+        text_fields = [text_field, "text_en"] if language != "en" else ["text_en"]
+
+        if self.snippets > 0:
+            params.update(self._highlight_params(text_fields))
+
+        with metrics.span("solr_request", language=language):
+            results = self.solr.search(clear_query,**params)
 
         # filter results based on processed query length and adjusted threshold
         # Use a more reasonable threshold (0.1 per query term)
         expected_score = len(clear_query.split()) * 0.1 * self.min_score_weight
-        results.docs = [doc for doc in results.docs if doc['score'] > expected_score]
-        
-        if len(results) == 0:
-            # if no results found, try to search in english
-            if language != "en":
-                #* translation could be done here
-                return self.search(clear_query, "en", top_n)
-            else:
-                return [], []
+        docs = [doc for doc in results.docs if doc['score'] > expected_score]
 
-        #* correcting the results because of nouns
-        scores : list[Tuple] = []
+        if self.snippets > 0:
+            self._insert_snippets(docs, results.highlighting or {}, text_fields)
+
+        return docs
+
+    # only the matching fragments of the texts are sent back (the beginning of the text if nothing matches)
+    def _highlight_params(self, text_fields : list[str]) -> dict[str, str]:
+        return {
+            "fl":               "id,score,title,url,parent_id",
+            "hl":               "true",
+            "hl.method":        "unified",
+            "hl.fl":            ",".join(text_fields),
+            "hl.snippets":      str(self.snippets),
+            "hl.fragsize":      str(self.fragment_size),
+            "hl.tag.pre":       "",
+            "hl.tag.post":      "",
+            "hl.defaultSummary":"true",
+        }
+
+    # the fragments become the text of the documents (the text of the query language if it has any)
+    @staticmethod
+    def _insert_snippets(docs : list[dict], highlighting : dict[str, dict[str, list[str]]], text_fields : list[str]):
+        for doc in docs:
+            fragments = highlighting.get(doc['id'], {})
 
-        for index, doc in enumerate(results.docs, start=1):
-            score = 500 - index * 50
-            text = re.sub(r'[^\w\s]', ' ', doc[text_field].lower())
+            for field in text_fields:
+                if fragments.get(field):
+                    doc[text_fields[0]] = " ... ".join(fragment.strip() for fragment in fragments[field])
+                    break
 
-            for word in text.split():
-                if word.strip() in clear_query:
-                    score += 1
+    def _rank(self, clear_query : str, language : str, docs : list[dict]) -> list[dict]:
+        if len(docs) == 0:
+            return []
 
-            ranking : Tuple = (score, doc)
-            scores.append(ranking)
+        # the documents are only indexed in english by default
+        text_field = f"text_{language}"
+        texts = [doc.get(text_field, doc.get('text_en', '')) for doc in docs]
 
-        #! right now it's just a single result, but it could return multiple documents
-        best_doc = max(scores, key=lambda x: x[0])[1]
+        #* correcting the results because of nouns
+        with metrics.span("rerank"):
+            scores = self.reranker.rank(clear_query, texts)
 
-        # Limit text to first 500 characters to avoid context overflow
-        full_text = best_doc[text_field]
-        # Take first 500 chars and try to end at a sentence
-        limited_text = full_text[:500]
-        last_period = limited_text.rfind('.')
-        if last_period > 100:  # If there's a sentence ending, use it
-            limited_text = limited_text[:last_period + 1]
-        limited_text += ("..." if len(full_text) > len(limited_text) else "")
+        # stable sort, the order of solr decides between equal scores
+        order = sorted(range(len(scores)), key=lambda index: scores[index], reverse=True)
+        found = []
 
-        best_texts = [
-            best_doc['title'] + "\n" + limited_text
-        ]
+        for index in order:
+            doc = docs[index]
+            found_doc = { "id": doc.get('id'), "title": doc['title'], "text": texts[index], "url": doc.get('url'), "score": scores[index] }
 
-        sources = []
+            if 'parent_id' in doc:
+                found_doc['parent_id'] = doc['parent_id']
 
-        if 'url' in best_doc:
-            sources.append(best_doc['url'])
+            found.append(found_doc)
 
-        return best_texts, sources
\ No newline at end of file
+        return found
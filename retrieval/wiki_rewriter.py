@@ -0,0 +1,214 @@
+import bisect
+import wikitextparser as wtp
+from typing import Callable
+
+SKIPPED_SECTIONS = ['see also', 'references', 'external links', 'further reading', 'notes']
+
+# the extension tags whose contents wikitextparser leaves as plain text (the old filter parsed them after removing the tags)
+UNPARSED_TAGS = {
+    'pre', 'nowiki', 'math', 'chem', 'ce', 'syntaxhighlight', 'source', 'score', 'hiero', 'timeline', 'graph',
+    'templatestyles', 'templatedata', 'charinsert', 'languages', 'mapframe', 'maplink', 'pages', 'pagelist', 'pagequality'
+}
+
+class _Node:
+    __slots__ = ["start", "end", "kind", "node", "children", "starts"]
+
+    def __init__(self, start : int, end : int, kind : str, node):
+        self.start = start
+        self.end = end
+        self.kind = kind
+        self.node = node
+        self.children : list["_Node"] = []
+        # the starts of the children for the binary search
+        self.starts : list[int] = []
+
+class WikiRewriter:
+    """
+    converts wikitext to the plain text of the WikiFilter from a single parse
+    the spans of the tags, templates, links and comments are collected once and every section is built from the text between them,
+    nested nodes are rendered inside their parents (e.g. the links in an infobox value)
+    handle_template returns the text of a template from its name and its (name, rendered value, rendered string, has value) arguments
+    """
+    def __init__(self, handle_template : Callable[[str, list[tuple[str, str, str, bool]]], str], keep_external_links : bool = True):
+        super().__init__()
+        self.handle_template = handle_template
+        self.keep_external_links = keep_external_links
+
+    # returns the tree of the nodes under a root node
+    def _collect(self, parsed : wtp.WikiText) -> _Node:
+        nodes = [_Node(*tag.span, "tag", tag) for tag in parsed.get_tags()]
+        nodes += [_Node(*template.span, "template", template) for template in parsed.templates]
+        nodes += [_Node(*link.span, "wikilink", link) for link in parsed.wikilinks if link.text or link.title]
+        nodes += [_Node(*comment.span, "comment", comment) for comment in parsed.comments]
+
+        if not self.keep_external_links:
+            nodes += [_Node(*link.span, "external", link) for link in parsed.external_links if link.text or link.url]
+
+        # parents come before their children
+        nodes.sort(key=lambda node: (node.start, -node.end))
+
+        root = _Node(0, len(parsed.string), "root", None)
+        stack = [root]
+
+        for node in nodes:
+            while len(stack) > 1 and stack[-1].end <= node.start:
+                stack.pop()
+
+            # a node overlapping its neighbour without being inside it is left as text
+            if node.end > stack[-1].end:
+                continue
+
+            stack[-1].children.append(node)
+            stack[-1].starts.append(node.start)
+            stack.append(node)
+
+        return root
+
+    """
+    returns the pieces of text[start:end] with the nodes replaced, as (text, is_node) pairs
+    the contents of the tags stay part of the surrounding text (like after the tag removal of the old filter)
+    """
+    def _pieces(self, start : int, end : int, parent : _Node, pieces : list[tuple[str, bool]]):
+        position = start
+        first = bisect.bisect_left(parent.starts, start)
+
+        for node in parent.children[first:]:
+            if node.start >= end:
+                break
+
+            # crossing the border of the range
+            if node.end > end:
+                continue
+
+            if node.start > position:
+                pieces.append((self.text[position:node.start], False))
+
+            if node.kind == "tag":
+                contents_start, contents_end = self._tag_contents(node)
+
+                if node.node.name.lower() in UNPARSED_TAGS:
+                    self._parse_pieces(self.text[contents_start:contents_end], pieces)
+                else:
+                    self._pieces(contents_start, contents_end, node, pieces)
+            else:
+                pieces.append((self._render_node(node), True))
+
+            position = node.end
+
+        if position < end:
+            pieces.append((self.text[position:end], False))
+
+    # the contents of an unparsed tag get their own parse, so their links and templates are replaced like in the old filter
+    def _parse_pieces(self, text : str, pieces : list[tuple[str, bool]]):
+        # without links, templates, tags or comments the old filter kept the text as it was
+        if "[[" not in text and "{{" not in text and "<" not in text and (self.keep_external_links or "[" not in text):
+            pieces.append((text, False))
+            return
+
+        outer_text = self.text
+        self.text = text
+        self._pieces(0, len(text), self._collect(wtp.parse(text)), pieces)
+        self.text = outer_text
+
+    def _render(self, start : int, end : int, parent : _Node) -> str:
+        pieces = []
+        self._pieces(start, end, parent, pieces)
+        return "".join(text for text, _ in pieces)
+
+    @staticmethod
+    def _tag_contents(node : _Node) -> tuple[int, int]:
+        contents = node.node.contents
+
+        if not contents:
+            return node.end, node.end
+
+        end = node.start + node.node.string.rfind("</")
+        return end - len(contents), end
+
+    # the span of a suffix of the node before its closing characters (e.g. the text of a link before the "]]")
+    def _suffix(self, node : _Node, value : str, closing : int) -> str:
+        end = node.end - closing
+        start = end - len(value)
+
+        if self.text[start:end] != value:
+            return value
+
+        return self._render(start, end, node)
+
+    def _render_node(self, node : _Node) -> str:
+        if node.kind == "comment":
+            return ""
+
+        if node.kind == "wikilink":
+            link = node.node
+            return self._suffix(node, link.text, 2) if link.text else link.title
+
+        if node.kind == "external":
+            link = node.node
+            return self._suffix(node, link.text, 1) if link.text else link.url
+
+        template = node.node
+        arguments = []
+
+        for argument in template.arguments:
+            value_end = argument.span[1]
+            value_start = value_end - len(argument.value)
+            string_start = argument.span[0] + (1 if argument.string.startswith("|") else 0)
+
+            arguments.append((
+                argument.name,
+                self._render(value_start, value_end, node),
+                self._render(string_start, value_end, node),
+                argument.value != "\n"
+            ))
+
+        return self.handle_template(template.name, arguments)
+
+    def rewrite(self, text : str) -> str:
+        self.text = text
+        parsed = wtp.parse(text)
+        root = self._collect(parsed)
+        result = []
+
+        for section in parsed.sections:
+            section_title = section.title
+
+            # skipping unnecessary sections
+            if section_title:
+                if section_title.lower() in SKIPPED_SECTIONS:
+                    continue
+                result.append(f'\n{section_title}\n')
+
+            contents_end = section.span[1]
+            pieces = []
+            self._pieces(contents_end - len(section.contents), contents_end, root, pieces)
+
+            result.append(self._strip(pieces).replace("\n===", "\n").replace("===\n", "\n").replace("\n==", "\n").replace("==\n", "\n") + '\n')
+
+        self.text = None
+        return "".join(result).strip()
+
+    # strips the whitespace of the text around the nodes (the nodes are replaced after the stripping in the old filter)
+    @staticmethod
+    def _strip(pieces : list[tuple[str, bool]]) -> str:
+        texts = [text for text, _ in pieces]
+
+        for index, (text, is_node) in enumerate(pieces):
+            if is_node:
+                break
+
+            texts[index] = text.lstrip()
+
+            if texts[index]:
+                break
+
+        for index in range(len(pieces) - 1, -1, -1):
+            if pieces[index][1]:
+                break
+
+            texts[index] = texts[index].rstrip()
+
+            if texts[index]:
+                break
+
+        return "".join(texts)